@@ -0,0 +1,87 @@
+import asyncio
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal, Protocol
+
+from loguru import logger
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+AudioBackendName = Literal["pygame", "null", "recording"]
+
+
+class AudioBackend(Protocol):
+    async def play(self, sound_path: Path) -> None: ...
+
+
+class PygameAudioBackend:
+    """Plays through the sound card and waits until the sound ends."""
+
+    def __init__(self) -> None:
+        import pygame
+
+        self.pygame = pygame
+        pygame.mixer.init()
+
+    async def play(self, sound_path: Path) -> None:
+        self.pygame.mixer.music.load(str(sound_path))
+        self.pygame.mixer.music.play()
+
+        while self.pygame.mixer.music.get_busy():
+            await asyncio.sleep(0.05)
+
+
+class NullAudioBackend:
+    """Drops every sound, playing completes instantly."""
+
+    async def play(self, sound_path: Path) -> None:
+        pass
+
+
+@dataclass(frozen=True)
+class PlayedSound:
+    path: Path
+    duration: float | None
+    # (frequency, size, channels) of the decoded audio, see `pygame.mixer.get_init`
+    format: tuple[int, int, int] | None
+
+
+class RecordingAudioBackend:
+    """Decodes the sounds without playing them and keeps what was played."""
+
+    def __init__(self) -> None:
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        import pygame
+
+        self.pygame = pygame
+        pygame.mixer.init()
+        self.played: list[PlayedSound] = []
+
+    async def play(self, sound_path: Path) -> None:
+        try:
+            sound = self.pygame.mixer.Sound(str(sound_path))
+            played = PlayedSound(
+                sound_path, sound.get_length(), self.pygame.mixer.get_init()
+            )
+        except self.pygame.error:
+            logger.exception(f"Could not decode {sound_path}")
+            played = PlayedSound(sound_path, None, None)
+
+        logger.info(
+            f"Played sound: {played.path} "
+            f"(duration: {played.duration}, format: {played.format})"
+        )
+        self.played.append(played)
+
+
+def create_audio_backend(name: AudioBackendName) -> AudioBackend:
+    match name:
+        case "pygame":
+            return PygameAudioBackend()
+        case "null":
+            return NullAudioBackend()
+        case "recording":
+            return RecordingAudioBackend()
+
+    raise ValueError(f"Unknown audio backend: {name}")
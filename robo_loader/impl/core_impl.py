@@ -1,17 +1,17 @@
 import asyncio
 from multiprocessing import Queue
 from multiprocessing.managers import DictProxy
-import os
 from pathlib import Path
+from time import time
 from typing import Any
 
+import numpy as np
 
+from robo_loader.impl.audio import AudioBackendName, create_audio_backend
 from robo_loader.impl.ext import get_sound_level
 from robo_loader.impl.models import Command, CommandVerb
-
-os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
-
-import pygame
+from robo_loader.impl.sensor_history import SensorHistory
+from robo_loader.impl.simulation import TimelineValues, VirtualClockEventLoop
 
 
 class CoreImpl:
@@ -23,15 +23,18 @@ class CoreImpl:
         title: str,
         root_path: Path,
         module_name: str,
+        audio_backend: AudioBackendName = "pygame",
+        sensor_history: SensorHistory | TimelineValues | None = None,
     ) -> None:
         self.values_shm = values_shm
+        self.sensor_history = sensor_history
         self.command_queue = command_queue
         self.author = author
         self.title = title
         self.root_path = root_path
         self.module_name = module_name
 
-        pygame.mixer.init()
+        self.audio = create_audio_backend(audio_backend)
 
     async def set_motor_angle(self, deg: int) -> None:
         """Servo motorun derecesini ayarlar."""
@@ -92,6 +95,21 @@ class CoreImpl:
     async def get_vibration(self) -> float:
         return await self._get_input("Titreşim")
 
+    async def get_history(self, label: str, seconds: float) -> np.ndarray:
+        """`label` etiketli sensörün son `seconds` saniyedeki değerlerini eskiden
+        yeniye doğru NumPy dizisi olarak döndürür.
+
+        Örnek:
+        ```python
+        temperatures = await get_history("Sıcaklık", 60)
+        print(temperatures.mean())
+        ```
+        Dizi değerler güncellendikçe değişebilir, saklamak için `.copy()` kullanın.
+        """
+        if self.sensor_history is None:
+            return np.empty(0)
+        return self.sensor_history.window(label, seconds)
+
     async def send_message(self, message: str) -> None:
         """Robot ekranındaki terminale mesaj gönderir.
         Terminaldeki mesajlar, aşağı doğru kayar.
@@ -135,9 +153,19 @@ class CoreImpl:
                 title=self.title,
                 verb=verb,
                 value=value,
+                sent_at=time(),
+                virtual_time=self._virtual_time(),
             )
         )
 
+    @staticmethod
+    def _virtual_time() -> float | None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+        return loop.time() if isinstance(loop, VirtualClockEventLoop) else None
+
     def _dispatch_event(self, event_name: str, value: Any) -> None:
         self._dispatch_command("event", (event_name, value))
 
@@ -191,9 +219,4 @@ class CoreImpl:
             raise exc
 
         self._dispatch_event("play_sound", Path(sound_path).absolute())
-
-        pygame.mixer.music.load(str(sound_path))
-        pygame.mixer.music.play()
-
-        while pygame.mixer.music.get_busy():
-            await asyncio.sleep(0.05)
+        await self.audio.play(Path(sound_path))
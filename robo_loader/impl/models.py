@@ -16,3 +16,7 @@ class Command(TypedDict):
     title: str
     verb: CommandVerb
     value: Any
+    # `time()` when the module sent it
+    sent_at: float
+    # Seconds on the simulation's virtual clock, `None` outside a simulation
+    virtual_time: float | None
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+from uuid import uuid4
+
+from loguru import logger
+
+from robo_loader import ROOT_PATH
+
+# Files a catalog entry is read from, relative to the module and its venv
+_MODULE_FILES = ("TITLE.txt", "AUTHOR.txt", "PHOTO.png", "requirements.txt")
+_VENV_FILES = (".creation_complete", ".installed")
+
+_Signature = tuple
+
+
+def _read_text(path: Path) -> str | None:
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    except (OSError, UnicodeDecodeError) as e:
+        # Only this module's field stays empty, the listing must go on
+        logger.warning(f"Could not read {path}: {e}")
+        return None
+
+
+def _md5(path: Path) -> str | None:
+    try:
+        return hashlib.md5(path.read_bytes()).hexdigest()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logger.warning(f"Could not read {path}: {e}")
+        return None
+
+
+@dataclass(frozen=True)
+class ModuleEntry:
+    name: str
+    path: Path
+    title: str | None
+    author: str | None
+    has_photo: bool
+    requirements_hash: str | None
+    venv_ready: bool
+
+    @staticmethod
+    def read(module_path: Path, venvs_path: Path) -> "ModuleEntry":
+        requirements_hash = _md5(module_path / "requirements.txt")
+        venv_path = venvs_path / module_path.name
+        # Same check as `VenvManager.is_ready`
+        venv_ready = (
+            requirements_hash is not None
+            and (venv_path / ".creation_complete").exists()
+            and _md5(venv_path / ".installed") == requirements_hash
+        )
+        return ModuleEntry(
+            name=module_path.name,
+            path=module_path,
+            title=_read_text(module_path / "TITLE.txt"),
+            author=_read_text(module_path / "AUTHOR.txt"),
+            has_photo=(module_path / "PHOTO.png").exists(),
+            requirements_hash=requirements_hash,
+            venv_ready=venv_ready,
+        )
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "title": self.title,
+            "author": self.author,
+            "has_photo": self.has_photo,
+            "requirements_hash": self.requirements_hash,
+            "venv_ready": self.venv_ready,
+        }
+
+
+class ModuleCatalog:
+    """Every module in `modules_path`, read once and kept in memory.
+
+    On access, at most every `poll_interval` seconds, the files entries are
+    read from are stat'ed and only the modules whose files changed are read
+    again. Modules are swapped in by renaming, which changes the inode.
+    """
+
+    def __init__(
+        self,
+        modules_path: Path | None = None,
+        venvs_path: Path | None = None,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.modules_path = modules_path or ROOT_PATH / "modules"
+        self.venvs_path = venvs_path or ROOT_PATH / "venvs"
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[_Signature, ModuleEntry]] = {}
+        self._checked_at: float | None = None
+        self._epoch = uuid4().hex[:8]
+        self._version = 0
+        self._json: tuple[int, bytes] | None = None
+
+    def _signature(self, module_path: Path) -> _Signature:
+        def stat(path: Path):
+            try:
+                st = path.stat()
+            except OSError:
+                return None
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        venv_path = self.venvs_path / module_path.name
+        return (
+            stat(module_path),
+            *(stat(module_path / name) for name in _MODULE_FILES),
+            *(stat(venv_path / name) for name in _VENV_FILES),
+        )
+
+    def _refresh(self) -> None:
+        if (
+            self._checked_at is not None
+            and monotonic() - self._checked_at < self.poll_interval
+        ):
+            return
+
+        module_paths = (
+            sorted(d for d in self.modules_path.iterdir() if d.is_dir())
+            if self.modules_path.exists()
+            else []
+        )
+
+        entries = {}
+        for module_path in module_paths:
+            signature = self._signature(module_path)
+            cached = self._entries.get(module_path.name)
+            if cached is not None and cached[0] == signature:
+                entries[module_path.name] = cached
+            else:
+                entry = ModuleEntry.read(module_path, self.venvs_path)
+                entries[module_path.name] = (signature, entry)
+
+        if entries != self._entries:
+            self._entries = entries
+            self._version += 1
+        self._checked_at = monotonic()
+
+    def invalidate(self) -> None:
+        """Makes the next access check the files regardless of the interval."""
+        with self._lock:
+            self._checked_at = None
+
+    def entries(self) -> dict[str, ModuleEntry]:
+        with self._lock:
+            self._refresh()
+            return {name: entry for name, (_, entry) in self._entries.items()}
+
+    def get(self, module_name: str) -> ModuleEntry | None:
+        return self.entries().get(module_name)
+
+    def paths(self) -> list[Path]:
+        return [entry.path for entry in self.entries().values()]
+
+    def entry_for(self, module_path: Path) -> ModuleEntry:
+        """The entry of a module that may be outside `modules_path`."""
+        entry = self.get(module_path.name)
+        if entry is not None and entry.path == module_path:
+            return entry
+        return ModuleEntry.read(module_path, self.venvs_path)
+
+    def json(self) -> tuple[str, bytes]:
+        """The catalog as a JSON list and its ETag, encoded once per change."""
+        with self._lock:
+            self._refresh()
+            if self._json is None or self._json[0] != self._version:
+                body = json.dumps(
+                    [entry.to_json() for _, entry in self._entries.values()],
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                self._json = (self._version, body)
+            return f'"{self._epoch}-{self._version}"', self._json[1]
+
+
+_catalog: ModuleCatalog | None = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> ModuleCatalog:
+    """The catalog of `ROOT_PATH / "modules"` shared within the process."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModuleCatalog()
+        return _catalog
@@ -1,20 +1,31 @@
+from contextlib import suppress
 import enum
+import multiprocessing
 from multiprocessing.managers import DictProxy
 from multiprocessing import Manager, Queue
+import os
 from multiprocessing.synchronize import Event
 from pathlib import Path
 from queue import Empty
 import queue
-from time import sleep
+from time import monotonic, sleep, time
 from typing import Any, Callable, cast
 from serial import Serial
 
 from loguru import logger
 
 from robo_loader.impl import transport
+from robo_loader.impl.audio import AudioBackendName
 from robo_loader.impl.models import Command, Identifier
 from robo_loader.impl.module_process import InfoQueue, ModuleInfo, ModuleProcess
+from robo_loader.impl.resources import ResourceLimits, ResourceMonitor
+from robo_loader.impl.sensor_history import SensorHistory
+from robo_loader.impl.simulation import Simulation
+from robo_loader.impl.startup_scheduler import StartupScheduler
+from robo_loader.impl.venv_manager import VenvManager
 from robo_loader import ROOT_PATH
+from robo_loader.utils.metrics import registry
+from robo_loader.utils.proc import kill_tree, register_process
 
 
 class _ActionType(enum.Enum):
@@ -27,13 +38,32 @@ class _ActionType(enum.Enum):
 
 _Action = tuple[_ActionType, Any]
 
+_loop_iterations = registry.counter(
+    "robo_loader_loop_iterations_total", "Iterations of the loader's action loop"
+)
+_actions = registry.counter(
+    "robo_loader_actions_total", "Actions handled by the loader", ("type",)
+)
+_commands = registry.counter(
+    "robo_commands_total", "Commands sent by modules", ("module", "verb")
+)
+_command_latency = registry.histogram(
+    "robo_command_latency_seconds",
+    "Time from a module sending a command until the loader has handled it",
+    ("verb",),
+)
+_queue_depth = registry.gauge(
+    "robo_loader_queue_depth", "Items waiting in the loader's queues", ("queue",)
+)
+
 
 def get_module_paths() -> list[Path]:
+    # A plain scan, the catalog may be up to its poll interval behind
     modules_path = ROOT_PATH / "modules"
     if not modules_path.exists():
         return []
 
-    return [d for d in modules_path.iterdir() if d.is_dir()]
+    return sorted(d for d in modules_path.iterdir() if d.is_dir())
 
 
 def get_module_path(module_name: str) -> Path:
@@ -50,6 +80,7 @@ class ModuleLoader:
         on_state_change: Callable[[Identifier, str], None] | None = None,
         on_message: Callable[[Identifier, str], None] | None = None,
         on_event: Callable[[Identifier, str, Any], None] | None = None,
+        on_command: Callable[[Command], None] | None = None,
         cancellation_event: Event | None = None,
         serial: Serial | None = None,
         ignore_deaths: bool = False,
@@ -59,11 +90,27 @@ class ModuleLoader:
         serial_in: "queue.Queue[bytes] | None" = None,
         serial_out: "queue.Queue[bytes] | None" = None,
         info_queue: "InfoQueue | None" = None,
+        startup_concurrency: int | None = None,
+        simulation: Simulation | None = None,
+        audio_backend: AudioBackendName = "pygame",
+        sensor_history: SensorHistory | None = None,
+        stop_timeout: float = 5.0,
+        resource_limits: ResourceLimits | None = None,
+        on_resources: Callable[[], None] | None = None,
     ) -> None:
+        """`sensor_history` is filled by its owner if given, otherwise the
+        loader creates one and fills it with the values it receives.
+
+        When cancelled, module processes get `stop_timeout` seconds to exit
+        after being terminated before they are killed.
+
+        The module processes' CPU and memory usage is sampled every second
+        into `resources.usage`, calling `on_resources` after each sample."""
         self.module_paths = module_paths or get_module_paths()
         self.on_state_change = on_state_change
         self.on_message = on_message
         self.on_event = on_event
+        self.on_command = on_command
         self.cancellation_event = cancellation_event
         self.serial = serial
         self.ignore_deaths = ignore_deaths
@@ -73,6 +120,16 @@ class ModuleLoader:
         self.serial_in = serial_in
         self.serial_out = serial_out
         self.info_queue = info_queue
+        self.startup_concurrency = startup_concurrency or os.cpu_count() or 4
+        self.simulation = simulation
+        self.audio_backend = audio_backend
+        self.sensor_history = sensor_history
+        self._owned_history: SensorHistory | None = None
+        self.stop_timeout = stop_timeout
+        self.killed: list[str] = []
+        self.resource_limits = resource_limits or ResourceLimits()
+        self.resources = ResourceMonitor(self.resource_limits, self._on_over_budget)
+        self.on_resources = on_resources
 
         self._last_transport_command = transport.TransportCommand(
             {
@@ -82,7 +139,11 @@ class ModuleLoader:
         )
         self._reported_deaths = set()
         self._serial_buffer = b""
+        self._queues_sampled_at = 0.0
         self.processes: list[ModuleProcess] = []
+        self._startup_scheduler = StartupScheduler(
+            self.startup_concurrency, self.info_queue
+        )
 
     def _is_cancelled(self):
         return self.cancellation_event is not None and self.cancellation_event.is_set()
@@ -116,27 +177,37 @@ class ModuleLoader:
 
     def load(self):
         with Manager() as manager:
+            register_process(manager._process.pid)  # type: ignore
+            sensor_history = self.sensor_history
+            if sensor_history is None:
+                sensor_history = self._owned_history = SensorHistory.create()
             try:
                 values = cast("DictProxy[str, Any]", manager.dict())
                 command_queue = cast("Queue[Command]", manager.Queue())
 
-                args = dict(values_shm=values, command_queue=command_queue)
+                args = dict(
+                    values_shm=values,
+                    command_queue=command_queue,
+                    audio_backend=self.audio_backend,
+                    sensor_history=sensor_history,
+                )
 
                 for module_dir in self.module_paths:
-                    if self.info_queue:
-                        self.info_queue.put_nowait(
-                            (module_dir.name, ModuleInfo.STARTING)
-                        )
-
+                    startup_done = multiprocessing.Event()
                     process = ModuleProcess(
                         module_dir,
                         args,
                         self.venvs_path,
                         self.log_path,
                         self.info_queue,
+                        startup_done,
+                        self.simulation,
+                        self.resource_limits,
+                    )
+                    venv_ready = VenvManager(module_dir.name, self.venvs_path).is_ready(
+                        module_dir / "requirements.txt"
                     )
-                    self.processes.append(process)
-                    process.start()
+                    self._startup_scheduler.add(process, startup_done, venv_ready)
 
                 while True:
                     actions = self._select_actions(command_queue)
@@ -147,22 +218,58 @@ class ModuleLoader:
                         )
 
                     if should_break:
+                        if self.simulation is not None:
+                            # Modules that finished may have left commands behind
+                            self._drain_commands(command_queue)
                         break
             finally:
-                for p in self.processes:
-                    p.terminate()
-
-                for p in self.processes:
-                    p.join()
+                self._stop_processes()
+
+                if self._owned_history is not None:
+                    self._owned_history.close()
+                    self._owned_history = None
+
+    def _stop_processes(self):
+        for p in self.processes:
+            p.terminate()
+
+        deadline = monotonic() + self.stop_timeout
+        for p in self.processes:
+            p.join(max(0.0, deadline - monotonic()))
+
+        if any(p.is_alive() for p in self.processes):
+            logger.warning(f"Modules didn't stop in {self.stop_timeout}s, killing.")
+            self.kill()
+            for p in self.processes:
+                p.join()
+
+    def kill(self) -> list[str]:
+        """Kills the module processes that are still alive, returns their names."""
+        alive = [p for p in self.processes if p.is_alive()]
+        for p in alive:
+            # Along with what it started, e.g. pip installing its requirements
+            kill_tree(p.pid)
+        killed = [p.name for p in alive]
+        self.killed.extend(killed)
+        return killed
 
     def _handle_action(self, action: _Action, values: "DictProxy[str, Any]"):
         action_type, payload = action
+        _actions.inc(type=action_type.name)
         match action_type:
             case _ActionType.CANCEL:
                 logger.info("Cancelling the loader.")
                 return True
             case _ActionType.DIED:
                 module_names = [p.name for p in payload]
+                # Simulated modules exit by themselves once their time is up
+                if self.simulation is not None and all(
+                    p.exitcode == 0 for p in payload
+                ):
+                    logger.info(f"{module_names} modules finished the simulation.")
+                    self._reported_deaths.update(module_names)
+                    return len(self._reported_deaths) == len(self.module_paths)
+
                 if self.ignore_deaths:
                     for name in module_names:
                         if name not in self._reported_deaths:
@@ -178,11 +285,26 @@ class ModuleLoader:
                 parsed_values = transport.parse_serial_line(str_values)
                 if parsed_values:
                     values.update(parsed_values)
+                    if self._owned_history is not None:
+                        self._owned_history.append(parsed_values)
             case _ActionType.INCOMING_PARSED_VALUES:
                 logger.info(f"Feeding values: {payload}")
                 values.update(payload)
+                if self._owned_history is not None:
+                    self._owned_history.append(payload)
+
+    def _drain_commands(self, command_queue: "Queue[Command]"):
+        while True:
+            try:
+                command = command_queue.get_nowait()
+            except Empty:
+                return
+            self._handle_command(command)
 
     def _handle_command(self, command: Command):
+        if self.on_command is not None:
+            self.on_command(command)
+
         author = command["author"]
         title = command["title"]
         verb = command["verb"]
@@ -215,8 +337,43 @@ class ModuleLoader:
             case _:
                 raise Exception(f"Unknown command verb: {verb}")
 
+        _commands.inc(module=module_name, verb=verb)
+        _command_latency.observe(time() - command["sent_at"], verb=verb)
+
+    def _start_admitted_processes(self):
+        for process in self._startup_scheduler.admit():
+            self.processes.append(process)
+            process.start()
+            register_process(process.pid)
+
+    def _on_over_budget(self, module_name: str, reason: str):
+        # Stopped on purpose, not a death
+        self._reported_deaths.add(module_name)
+        if self.info_queue is not None:
+            self.info_queue.put_nowait((module_name, ModuleInfo.OVER_BUDGET, None))
+
+    def _sample_queues(self, command_queue: "Queue[Command]"):
+        # The command queue lives in the manager process, don't ask it every loop
+        now = monotonic()
+        if now - self._queues_sampled_at < 1:
+            return
+        self._queues_sampled_at = now
+
+        queues = {"command": command_queue, "values": self.values_queue}
+        for name, queue_ in queues.items():
+            # qsize isn't implemented on macOS
+            with suppress(NotImplementedError):
+                if queue_ is not None:
+                    _queue_depth.set(queue_.qsize(), queue=name)
+
     def _select_actions(self, command_queue: "Queue[Command]") -> list[_Action]:
         while True:
+            _loop_iterations.inc()
+            self._start_admitted_processes()
+            self._sample_queues(command_queue)
+            if self.resources.poll(self.processes) and self.on_resources is not None:
+                self.on_resources()
+
             actions = []
             if self._is_cancelled():
                 actions.append((_ActionType.CANCEL, None))
@@ -239,7 +396,11 @@ class ModuleLoader:
                 actions.append((_ActionType.INCOMING_VALUES, line.decode("utf-8")))
 
             if not self.ignore_deaths:
-                died_processes = [p for p in self.processes if not p.is_alive()]
+                died_processes = [
+                    p
+                    for p in self.processes
+                    if not p.is_alive() and p.name not in self._reported_deaths
+                ]
                 if len(died_processes) > 0:
                     actions.append((_ActionType.DIED, died_processes))
 
@@ -5,6 +5,7 @@ from multiprocessing.managers import ListProxy
 import os
 import sys
 from multiprocessing import Process, Queue
+from multiprocessing.synchronize import Event
 from pathlib import Path
 from typing import TypeAlias
 import warnings
@@ -13,6 +14,9 @@ from loguru import logger
 
 import robo_loader.impl.dummy_core as dummy_core
 from robo_loader.impl.core_impl import CoreImpl
+from robo_loader.impl.module_catalog import get_catalog
+from robo_loader.impl.resources import ResourceLimits
+from robo_loader.impl.simulation import Simulation, TimelineValues
 from robo_loader.impl.venv_manager import VenvManager
 
 
@@ -23,9 +27,11 @@ class ModuleInfo(Enum):
     RUNNING = 3
     STOPPED = 4
     ERRORED = 5
+    QUEUED = 6
+    OVER_BUDGET = 7
 
     @staticmethod
-    def to_str(info: "ModuleInfo") -> str:
+    def to_str(info: "ModuleInfo", queue_position: int | None = None) -> str:
         match info:
             case ModuleInfo.STARTING:
                 return "Başlatılıyor"
@@ -39,11 +45,18 @@ class ModuleInfo(Enum):
                 return "Durduruldu"
             case ModuleInfo.ERRORED:
                 return "Hata"
+            case ModuleInfo.QUEUED:
+                if queue_position is not None:
+                    return f"Sırada ({queue_position}.)"
+                return "Sırada"
+            case ModuleInfo.OVER_BUDGET:
+                return "Kaynak sınırı aşıldı"
 
         return "Bilinmiyor"
 
 
-InfoQueue: TypeAlias = "Queue[tuple[str, ModuleInfo]]"
+# (module name, info, queue position)
+InfoQueue: TypeAlias = "Queue[tuple[str, ModuleInfo, int | None]]"
 
 
 class ModuleProcess(Process):
@@ -54,6 +67,9 @@ class ModuleProcess(Process):
         venvs_path: Path,
         log_path: Path | None,
         info_queue: "InfoQueue | None",
+        startup_done: Event | None = None,
+        simulation: Simulation | None = None,
+        limits: ResourceLimits | None = None,
     ):
         super().__init__(daemon=True, name=f"ModuleProcess-{module_path.name}")
         self.module_path = module_path
@@ -61,12 +77,26 @@ class ModuleProcess(Process):
         self.venvs_path = venvs_path
         self.log_path = log_path
         self.info_queue = info_queue
+        self.startup_done = startup_done
+        self.simulation = simulation
+        self.limits = limits
+
+        # Read here from the catalog, not again in the new process
+        entry = get_catalog().entry_for(module_path)
+        self.title = entry.title or "Bilinmiyor"
+        self.author = entry.author or "Bilinmiyor"
 
     @property
     def name(self) -> str:
         return self.module_path.name
 
     def run(self):
+        if self.limits is not None:
+            try:
+                self.limits.apply()
+            except OSError as e:
+                logger.warning(f"Couldn't apply the resource limits: {e}")
+
         os.environ["OPENCV_VIDEOIO_DEBUG"] = "0"
         os.environ["OPENCV_LOG_LEVEL"] = "OFF"
 
@@ -111,7 +141,7 @@ class ModuleProcess(Process):
 
     def _report_info(self, info: ModuleInfo):
         if self.info_queue is not None:
-            self.info_queue.put_nowait((self.module_path.name, info))
+            self.info_queue.put_nowait((self.module_path.name, info, None))
 
     def _run_module(
         self,
@@ -119,25 +149,20 @@ class ModuleProcess(Process):
         args: dict,
         venvs_path: Path,
     ):
-        title_file = module_dir / "TITLE.txt"
-        author_file = module_dir / "AUTHOR.txt"
-
         module_name = module_dir.name
-        title = (
-            title_file.read_text(encoding="utf-8").strip()
-            if title_file.exists()
-            else "Bilinmiyor"
-        )
-        author = (
-            author_file.read_text(encoding="utf-8").strip()
-            if author_file.exists()
-            else "Bilinmiyor"
-        )
+
+        if self.simulation is not None:
+            timeline_values = TimelineValues(self.simulation)
+            args = {
+                **args,
+                "values_shm": timeline_values,
+                "sensor_history": timeline_values,
+            }
 
         core_impl = CoreImpl(
             module_name=module_name,
-            author=author,
-            title=title,
+            author=self.author,
+            title=self.title,
             root_path=module_dir,
             **args,
         )
@@ -179,9 +204,15 @@ class ModuleProcess(Process):
         if (not hasattr(module, "main")) or (not callable(module.main)):
             raise Exception(f"Module '{module_dir.name}' has no 'main' function.")
 
+        if self.startup_done is not None:
+            self.startup_done.set()
+
         self._report_info(ModuleInfo.RUNNING)
         try:
-            asyncio.run(module.main(core_impl))  # type: ignore
+            if self.simulation is not None:
+                self.simulation.run(module.main(core_impl))  # type: ignore
+            else:
+                asyncio.run(module.main(core_impl))  # type: ignore
             self._report_info(ModuleInfo.STOPPED)
         except:
             logger.exception(f"Module '{module_dir.name}' has thrown an exception.")
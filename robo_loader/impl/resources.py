@@ -0,0 +1,175 @@
+import os
+import sys
+from dataclasses import dataclass
+from multiprocessing import Process
+from time import monotonic
+from typing import Callable
+
+from loguru import logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """Limits of every module process.
+
+    `memory_mb`, `nice` and `cpu_affinity` are applied by the process itself
+    when it starts, where the platform supports them. The budgets are
+    enforced by the loader: a module using more than `cpu_budget` (1.0 is
+    one core) is moved to the lowest priority, and stopped if it keeps doing
+    so for `over_budget_seconds`. One using more than `rss_budget_mb` is
+    stopped right away.
+    """
+
+    memory_mb: int | None = None
+    nice: int | None = None
+    cpu_affinity: frozenset[int] | None = None
+
+    cpu_budget: float | None = None
+    rss_budget_mb: float | None = None
+    over_budget_seconds: float = 30.0
+
+    def apply(self) -> None:
+        """Applies the limits to the current process."""
+        if self.nice is not None and hasattr(os, "nice"):
+            os.nice(self.nice)
+        if self.cpu_affinity is not None and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpu_affinity)
+        if self.memory_mb is not None and resource is not None:
+            # The address space, RLIMIT_RSS isn't enforced by Linux
+            limit = self.memory_mb * 2**20
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+@dataclass(frozen=True)
+class ResourceUsage:
+    cpu_seconds: float
+    # Of one core, since the previous sample
+    cpu_percent: float
+    rss_mb: float
+    throttled: bool = False
+
+    def to_str(self) -> str:
+        return f"%{self.cpu_percent:.0f} CPU, {self.rss_mb:.0f} MB"
+
+    def to_json(self) -> dict:
+        return {
+            "cpu_seconds": self.cpu_seconds,
+            "cpu_percent": self.cpu_percent,
+            "rss_mb": self.rss_mb,
+            "throttled": self.throttled,
+        }
+
+
+def sample_process(pid: int) -> tuple[float, float] | None:
+    """CPU seconds and RSS in MiB of a process, `None` if they can't be read."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The process name can contain spaces, the fields start after ")"
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+    # utime, stime and rss are the 14th, 15th and 24th fields
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    rss_mb = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    return cpu_seconds, rss_mb
+
+
+class ResourceMonitor:
+    """Samples the module processes of a loader and enforces the budgets of
+    `limits`, calling `on_over_budget` with the module name and the reason
+    when it stops one."""
+
+    def __init__(
+        self,
+        limits: ResourceLimits,
+        on_over_budget: Callable[[str, str], None] | None = None,
+        interval: float = 1.0,
+    ) -> None:
+        self.limits = limits
+        self.on_over_budget = on_over_budget
+        self.interval = interval
+
+        self.usage: dict[str, ResourceUsage] = {}
+        self._sampled_at: float | None = None
+        self._over_since: dict[str, float] = {}
+        self._throttled: set[str] = set()
+        # Module name: why it was stopped
+        self.stopped: dict[str, str] = {}
+
+    def poll(self, processes: list[Process]) -> bool:
+        """Samples the processes if `interval` has passed, returns whether
+        there is something to report: a process was sampled, or the usage
+        of the previous sample is gone. Where processes can't be sampled,
+        that's never."""
+        now = monotonic()
+        if self._sampled_at is not None and now - self._sampled_at < self.interval:
+            return False
+        elapsed = now - self._sampled_at if self._sampled_at is not None else None
+        self._sampled_at = now
+
+        usage = {}
+        for process in processes:
+            if process.pid is None or not process.is_alive():
+                continue
+            sample = sample_process(process.pid)
+            if sample is None:
+                continue
+
+            cpu_seconds, rss_mb = sample
+            previous = self.usage.get(process.name)
+            cpu_percent = (
+                max(0.0, 100 * (cpu_seconds - previous.cpu_seconds) / elapsed)
+                if previous is not None and elapsed
+                else 0.0
+            )
+            usage[process.name] = ResourceUsage(
+                cpu_seconds,
+                cpu_percent,
+                rss_mb,
+                throttled=process.name in self._throttled,
+            )
+            self._enforce(process, usage[process.name], now)
+
+        changed = usage != self.usage
+        self.usage = usage
+        return bool(usage) or changed
+
+    def _enforce(self, process: Process, usage: ResourceUsage, now: float):
+        limits = self.limits
+        name = process.name
+
+        if limits.rss_budget_mb is not None and usage.rss_mb > limits.rss_budget_mb:
+            self._stop(process, f"{usage.rss_mb:.0f} MB bellek kullandı")
+            return
+
+        if limits.cpu_budget is None or usage.cpu_percent <= 100 * limits.cpu_budget:
+            self._over_since.pop(name, None)
+            return
+
+        over_since = self._over_since.setdefault(name, now)
+        if name not in self._throttled and hasattr(os, "setpriority"):
+            logger.warning(f"{name} uses {usage.to_str()}, lowering its priority.")
+            try:
+                os.setpriority(os.PRIO_PROCESS, process.pid, 19)  # type: ignore
+                self._throttled.add(name)
+            except OSError as e:
+                logger.warning(f"Couldn't lower the priority of {name}: {e}")
+
+        if now - over_since >= limits.over_budget_seconds:
+            self._stop(process, f"%{usage.cpu_percent:.0f} işlemci kullandı")
+
+    def _stop(self, process: Process, reason: str) -> None:
+        logger.warning(f"Stopping {process.name}, it is over budget: {reason}")
+        process.kill()
+        self._over_since.pop(process.name, None)
+        self.stopped[process.name] = reason
+        if self.on_over_budget is not None:
+            self.on_over_budget(process.name, reason)
@@ -0,0 +1,151 @@
+import sys
+from multiprocessing import shared_memory
+from time import time
+
+import numpy as np
+from loguru import logger
+
+from robo_loader.impl.transport import TrasportValues
+
+SENSOR_LABELS: list[str] = list(TrasportValues.__annotations__)
+
+# Mappings that were closed while still in use, kept so they stay mapped
+_kept_open: list[shared_memory.SharedMemory] = []
+
+
+class SensorHistory:
+    """The last `capacity` sensor frames of every label, in shared memory.
+
+    Every sample is written twice, at `i` and `i + capacity`, so the last `n`
+    samples are always one contiguous slice and windows are returned as
+    NumPy views without copying. A view stays valid until `capacity` more
+    frames are written, copy it to keep it longer.
+
+    There must be a single writer, any number of processes can read.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, capacity: int) -> None:
+        self.shm = shm
+        self.capacity = capacity
+        self._owner = False
+
+        labels = len(SENSOR_LABELS)
+        self._count = np.ndarray((1,), np.int64, shm.buf, 0)
+        self._times = np.ndarray((2 * capacity,), np.float64, shm.buf, 8)
+        self._values = np.ndarray(
+            (labels, 2 * capacity), np.float64, shm.buf, 8 + 16 * capacity
+        )
+        self._label_index = {label: i for i, label in enumerate(SENSOR_LABELS)}
+
+    @staticmethod
+    def create(capacity: int = 36_000) -> "SensorHistory":
+        size = 8 + 8 * 2 * capacity * (1 + len(SENSOR_LABELS))
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        history = SensorHistory(shm, capacity)
+        history._owner = True
+        history._count[0] = 0
+        return history
+
+    @staticmethod
+    def attach(name: str, capacity: int) -> "SensorHistory":
+        # Module processes share the creator's resource tracker, attaching
+        # doesn't make them responsible for unlinking it
+        return SensorHistory(shared_memory.SharedMemory(name=name), capacity)
+
+    def __reduce__(self):
+        return (SensorHistory.attach, (self.shm.name, self.capacity))
+
+    def append(self, values: dict, timestamp: float | None = None) -> None:
+        count = int(self._count[0])
+        i = count % self.capacity
+        t = time() if timestamp is None else timestamp
+        self._times[i] = self._times[i + self.capacity] = t
+        for label, j in self._label_index.items():
+            value = values.get(label)
+            try:
+                value = float(value)  # type: ignore
+            except (TypeError, ValueError):
+                value = np.nan
+            self._values[j, i] = self._values[j, i + self.capacity] = value
+        # Readers only look at samples below the count, publish it last
+        self._count[0] = count + 1
+
+    def _window(self, seconds: float, now: float | None) -> tuple[int, int]:
+        count = int(self._count[0])
+        # Once full, the oldest slot is the one the writer may be overwriting
+        n = min(count, self.capacity - 1)
+        start = (count - n) % self.capacity
+        times = self._times[start : start + n]
+        now = time() if now is None else now
+        cut = int(np.searchsorted(times, now - seconds, side="left"))
+        return start + cut, start + n
+
+    def window(
+        self, label: str, seconds: float, now: float | None = None
+    ) -> np.ndarray:
+        """Values of `label` from the last `seconds` seconds, oldest first."""
+        start, end = self._window(seconds, now)
+        return self._values[self._label_index[label], start:end]
+
+    def times_and_values(
+        self, label: str, seconds: float, now: float | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        start, end = self._window(seconds, now)
+        values = self._values[self._label_index[label], start:end]
+        return self._times[start:end], values
+
+    def close(self) -> None:
+        """Detaches from the shared memory, the creator also frees it.
+
+        While windows are still referenced the mapping is kept until the
+        process exits, unmapping it would leave them pointing at nothing.
+        """
+        arrays = (self._count, self._times, self._values)
+        del self._count, self._times, self._values
+        # Windows are views, each holds a reference to its base array. The
+        # tuple, the loop and getrefcount itself hold the other three.
+        in_use = any(sys.getrefcount(array) > 3 for array in arrays)
+        del arrays
+
+        if in_use:
+            logger.warning("Sensor history closed while a window is in use")
+            _kept_open.append(self.shm)
+        else:
+            try:
+                self.shm.close()
+            except BufferError:
+                logger.warning("Sensor history closed while a window is in use")
+                _kept_open.append(self.shm)
+        if self._owner:
+            self.shm.unlink()
+
+
+def downsample(
+    times: np.ndarray, values: np.ndarray, points: int
+) -> dict[str, list[float]]:
+    """Splits the samples into `points` equally long time buckets and returns
+    the min, max and mean of each non-empty one."""
+    valid = ~np.isnan(values)
+    times, values = times[valid], values[valid]
+    if len(times) == 0:
+        return {"t": [], "min": [], "max": [], "mean": []}
+
+    start, end = times[0], times[-1]
+    width = (end - start) / points or 1.0
+    buckets = np.minimum(((times - start) / width).astype(np.int64), points - 1)
+
+    counts = np.bincount(buckets, minlength=points)
+    sums = np.bincount(buckets, weights=values, minlength=points)
+    mins = np.full(points, np.inf)
+    maxs = np.full(points, -np.inf)
+    np.minimum.at(mins, buckets, values)
+    np.maximum.at(maxs, buckets, values)
+
+    filled = counts > 0
+    bucket_times = start + (np.arange(points) + 0.5) * width
+    return {
+        "t": bucket_times[filled].tolist(),
+        "min": mins[filled].tolist(),
+        "max": maxs[filled].tolist(),
+        "mean": (sums[filled] / counts[filled]).tolist(),
+    }
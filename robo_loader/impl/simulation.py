@@ -0,0 +1,129 @@
+import asyncio
+import bisect
+import random
+import selectors
+import time
+from dataclasses import dataclass, field
+from typing import Any, Coroutine
+
+import numpy as np
+from loguru import logger
+
+SensorFrame = tuple[float, dict[str, float]]
+
+
+class _VirtualSelector:
+    """Wraps the loop's selector, instead of blocking until the next timer it
+    polls for I/O and moves the loop's clock forward."""
+
+    def __init__(self, selector: selectors.BaseSelector, loop: "VirtualClockEventLoop"):
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout: float | None = None):
+        events = self._selector.select(0)
+        if events or timeout == 0:
+            return events
+
+        # Nothing is scheduled, only I/O (executors, sockets) can wake us up
+        if timeout is None:
+            return self._selector.select(None)
+
+        # A thread is still working for a task, time passes for real until then
+        if self._loop.executor_jobs > 0:
+            start = time.monotonic()
+            events = self._selector.select(timeout)
+            self._loop.advance(time.monotonic() - start)
+            return events
+
+        self._loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._selector, name)
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """An event loop whose clock only moves when every task is sleeping, so
+    `asyncio.sleep(60)` returns instantly."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._virtual_time = 0.0
+        self._selector = _VirtualSelector(self._selector, self)  # type: ignore
+        self.executor_jobs = 0
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float) -> None:
+        self._virtual_time += seconds
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._executor_job_done)
+        return future
+
+    def _executor_job_done(self, _):
+        self.executor_jobs -= 1
+
+
+@dataclass(frozen=True)
+class Simulation:
+    """Runs a module on a virtual clock for `duration` virtual seconds, sensor
+    values are read from `timeline` instead of the serial port."""
+
+    duration: float
+    timeline: list[SensorFrame] = field(default_factory=list)
+
+    def values_at(self, t: float) -> dict[str, float]:
+        index = bisect.bisect_right(self.timeline, t, key=lambda frame: frame[0])
+        if index == 0:
+            return {}
+        return self.timeline[index - 1][1]
+
+    def run(self, main: Coroutine) -> None:
+        with asyncio.Runner(loop_factory=VirtualClockEventLoop) as runner:
+            runner.run(self._run_for_duration(main))
+
+    async def _run_for_duration(self, main: Coroutine) -> None:
+        try:
+            await asyncio.wait_for(main, self.duration)
+        except TimeoutError:
+            logger.info(f"Simulation finished after {self.duration} virtual seconds")
+
+
+class TimelineValues:
+    """Stands in for the shared values dict of `CoreImpl` during a simulation."""
+
+    def __init__(self, simulation: Simulation) -> None:
+        self.simulation = simulation
+
+    def get(self, label: str, default: Any = None) -> Any:
+        now = asyncio.get_running_loop().time()
+        return self.simulation.values_at(now).get(label, default)
+
+    def window(self, label: str, seconds: float) -> np.ndarray:
+        """Stands in for `SensorHistory.window`, in virtual time."""
+        now = asyncio.get_running_loop().time()
+        return np.array(
+            [
+                values.get(label, np.nan)
+                for t, values in self.simulation.timeline
+                if now - seconds <= t <= now
+            ],
+            dtype=np.float64,
+        )
+
+
+def random_timeline(
+    duration: float, labels: list[str], interval: float = 10
+) -> list[SensorFrame]:
+    """A new frame of random values every `interval` seconds."""
+    frames = []
+    t = 0.0
+    while t <= duration:
+        frames.append((t, {label: random.randint(0, 500) for label in labels}))
+        t += interval
+    return frames
@@ -0,0 +1,70 @@
+import multiprocessing.synchronize
+from dataclasses import dataclass
+
+from robo_loader.impl.module_process import InfoQueue, ModuleInfo, ModuleProcess
+
+
+@dataclass
+class _Entry:
+    process: ModuleProcess
+    startup_done: multiprocessing.synchronize.Event
+    venv_ready: bool
+
+
+class StartupScheduler:
+    """Admits module processes so that only `max_concurrent` of them are
+    installing requirements or importing their code at the same time.
+
+    Modules with ready venvs are admitted before the ones that need pip.
+    """
+
+    def __init__(self, max_concurrent: int, info_queue: "InfoQueue | None") -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self.info_queue = info_queue
+
+        self._pending: list[_Entry] = []
+        self._starting: list[_Entry] = []
+
+    def add(
+        self,
+        process: ModuleProcess,
+        startup_done: multiprocessing.synchronize.Event,
+        venv_ready: bool,
+    ) -> None:
+        entry = _Entry(process, startup_done, venv_ready)
+        if venv_ready:
+            index = next(
+                (i for i, e in enumerate(self._pending) if not e.venv_ready),
+                len(self._pending),
+            )
+            self._pending.insert(index, entry)
+        else:
+            self._pending.append(entry)
+
+    def admit(self) -> list[ModuleProcess]:
+        """Returns the processes that should be started now."""
+        if not self._pending:
+            return []
+
+        self._starting = [
+            e
+            for e in self._starting
+            if e.process.is_alive() and not e.startup_done.is_set()
+        ]
+
+        admitted = []
+        while self._pending and len(self._starting) < self.max_concurrent:
+            entry = self._pending.pop(0)
+            self._starting.append(entry)
+            admitted.append(entry.process)
+            self._report(entry.process.name, ModuleInfo.STARTING)
+
+        if admitted:
+            for position, entry in enumerate(self._pending, start=1):
+                self._report(entry.process.name, ModuleInfo.QUEUED, position)
+
+        return admitted
+
+    def _report(self, module_name: str, info: ModuleInfo, position: int | None = None):
+        if self.info_queue is not None:
+            self.info_queue.put_nowait((module_name, info, position))
@@ -1,6 +1,15 @@
+from contextlib import suppress
 import json
 from typing import TypedDict
 
+from robo_loader.utils.metrics import registry
+
+_serial_lines = registry.counter(
+    "robo_serial_lines_total", "Lines received from the serial port"
+)
+_parse_failures = registry.counter(
+    "robo_serial_parse_failures_total", "Serial lines that aren't sensor values"
+)
 
 TrasportValues = TypedDict(
     "TrasportValues",
@@ -32,6 +41,7 @@ TransportCommand = TypedDict(
 
 
 def parse_serial_line(line: str) -> TrasportValues | None:
+    _serial_lines.inc()
     try:
         incoming: dict[str, float] = json.loads(line)
         rv = TrasportValues(
@@ -51,11 +61,13 @@ def parse_serial_line(line: str) -> TrasportValues | None:
                 "Blue": incoming["Blue"],
             }
         )
-        with open("debug.txt", "w") as f:
-            json.dump(rv, f, ensure_ascii=True)
-        return rv
-    except:
-        ...
+    except (ValueError, KeyError, TypeError):
+        _parse_failures.inc()
+        return None
+
+    with suppress(OSError), open("debug.txt", "w") as f:
+        json.dump(rv, f, ensure_ascii=True)
+    return rv
 
 
 def stringify_command(command: TransportCommand) -> str | None:
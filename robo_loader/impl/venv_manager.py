@@ -1,11 +1,11 @@
 from pathlib import Path
-import subprocess
 import sys
 import virtualenv
 from loguru import logger
 import runpy
 from robo_loader import ROOT_PATH
-from robo_loader.utils.fs import rmrf
+from robo_loader.utils.fs import trash
+from robo_loader.utils.proc import run_process
 
 # REQUIREMENT_CORRECTIONS = {
 #     "os": None,
@@ -41,7 +41,7 @@ class VenvManager:
             return
 
         if venv_path.exists():
-            rmrf(venv_path)
+            trash(venv_path)
 
         logger.info(f"Creating venv with {sys.executable}")
         virtualenv.cli_run([str(venv_path), "--python", sys.executable])
@@ -52,16 +52,26 @@ class VenvManager:
     def interpreter_path(self) -> Path:
         return self.venv_path / "Scripts" / "python.exe"
 
+    @property
+    def installed_cache_file(self) -> Path:
+        return self.venv_path / ".installed"
+
+    def is_ready(self, requirements_path: Path) -> bool:
+        """Whether the venv exists and has `requirements_path` installed."""
+        return (
+            (self.venv_path / ".creation_complete").exists()
+            and self.installed_cache_file.exists()
+            and requirements_path.exists()
+            and self.installed_cache_file.read_bytes() == requirements_path.read_bytes()
+        )
+
     def ensure_requirements(self, requirements_path: Path) -> None:
         self.ensure_venv()
 
-        installed_cache_file = self.venv_path / ".installed"
+        installed_cache_file = self.installed_cache_file
         # failed_cache_file = self.venv_path / ".failed"
 
-        if (
-            installed_cache_file.exists()
-            and installed_cache_file.read_bytes() == requirements_path.read_bytes()
-        ):
+        if self.is_ready(requirements_path):
             return
 
         # if (
@@ -73,17 +83,17 @@ class VenvManager:
         #     )
 
         logger.info(f"Installing requirements for venv: {self.venv_name}")
-        pip = subprocess.run(
+        pip = run_process(
             [
                 str(self.interpreter_path),
                 "-m",
                 "pip",
                 "install",
                 "-q",
+                "--no-compile",
                 "-r",
                 str(requirements_path),
             ],
-            capture_output=True,
         )
 
         if pip.returncode != 0:
@@ -93,9 +103,36 @@ class VenvManager:
                 f"Failed to install requirements for venv: {self.venv_name}\n{stderr}"
             )
 
+        self.compile_bytecode()
+
         installed_cache_file.write_bytes(requirements_path.read_bytes())
         logger.info(f"Installed requirements for venv: {self.venv_name}")
 
+    @property
+    def site_packages_path(self) -> Path:
+        return self.venv_path / "Lib" / "site-packages"
+
+    def compile_bytecode(self) -> None:
+        """Compiles the installed packages with one worker per CPU, pip is
+        told not to do it since it compiles them one by one."""
+        logger.info(f"Compiling bytecode for venv: {self.venv_name}")
+        compileall = run_process(
+            [
+                str(self.interpreter_path),
+                "-m",
+                "compileall",
+                "-q",
+                "-j",
+                "0",
+                str(self.site_packages_path),
+            ],
+        )
+
+        if compileall.returncode != 0:
+            logger.warning(
+                f"Some packages could not be compiled for venv: {self.venv_name}"
+            )
+
     def activate(self):
         self.ensure_venv()
         activate_this_path = (
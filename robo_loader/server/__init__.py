@@ -1,7 +1,85 @@
+import argparse
+
 import uvicorn
 
+from robo_loader.impl.resources import ResourceLimits
 from robo_loader.server.app import app
 
 
+def parse_cpus(value: str) -> frozenset[int]:
+    try:
+        return frozenset(int(cpu) for cpu in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid CPU list: {value}")
+
+
+class Server(uvicorn.Server):
+    def handle_exit(self, sig: int, frame) -> None:
+        # The graceful shutdown waits for the open event streams before the
+        # lifespan cancels the modules, so they have to end first
+        mtm = getattr(app.state, "module_thread_manager", None)
+        if mtm is not None:
+            mtm.events.close()
+        super().handle_exit(sig, frame)
+
+
 def main():
-    uvicorn.run(app)
+    parser = argparse.ArgumentParser(description="Runs the modules and the panel.")
+    parser.add_argument(
+        "--stop-timeout",
+        type=float,
+        default=5.0,
+        metavar="SECONDS",
+        help="How long a stopping module gets before it is killed",
+    )
+    parser.add_argument(
+        "--max-overlap",
+        type=int,
+        default=0,
+        metavar="N",
+        help="How many previous loaders may still be stopping after a switch",
+    )
+
+    limits = parser.add_argument_group("limits of every module")
+    limits.add_argument("--memory-mb", type=int, help="Address space limit")
+    limits.add_argument("--nice", type=int, help="Added to the niceness")
+    limits.add_argument(
+        "--cpu-affinity",
+        type=parse_cpus,
+        metavar="CPUS",
+        help="Comma separated CPUs the modules may run on",
+    )
+    limits.add_argument(
+        "--cpu-budget",
+        type=float,
+        metavar="CORES",
+        help="CPU use above which a module gets the lowest priority",
+    )
+    limits.add_argument(
+        "--rss-budget-mb",
+        type=float,
+        metavar="MB",
+        help="Memory use above which a module is stopped",
+    )
+    limits.add_argument(
+        "--over-budget-seconds",
+        type=float,
+        default=ResourceLimits.over_budget_seconds,
+        metavar="SECONDS",
+        help="How long a module may stay over --cpu-budget before it is stopped",
+    )
+    args = parser.parse_args()
+
+    app.state.manager_options = dict(
+        stop_timeout=args.stop_timeout,
+        max_overlap=args.max_overlap,
+        resource_limits=ResourceLimits(
+            memory_mb=args.memory_mb,
+            nice=args.nice,
+            cpu_affinity=args.cpu_affinity,
+            cpu_budget=args.cpu_budget,
+            rss_budget_mb=args.rss_budget_mb,
+            over_budget_seconds=args.over_budget_seconds,
+        ),
+    )
+    Server(uvicorn.Config(app)).run()
@@ -5,21 +5,25 @@ from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Annotated, cast
 
-from fastapi import Body, Depends, FastAPI, Request, Response
-from fastapi.responses import FileResponse
+from fastapi import Body, Depends, FastAPI, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from loguru import logger
 from serial import Serial, SerialException
 
 from robo_loader import ROOT_PATH
 from robo_loader.impl import module_loader
-from robo_loader.impl.module_process import ModuleInfo
+from robo_loader.impl.module_catalog import get_catalog
+from robo_loader.impl.sensor_history import SENSOR_LABELS, downsample
+from robo_loader.server.events import Event
 from robo_loader.server.module_thread import (
     ModuleThread,
     Status,
     Statuses as StatusesType,
 )
 from robo_loader.server.module_thread_manager import ModuleThreadManager
+from robo_loader.server.photos import Photo, PhotoSize
+from robo_loader.utils.metrics import registry
 
 
 class StateDep:
@@ -44,7 +48,9 @@ async def lifespan(app: FastAPI):
     logger.info(f"Using serial: {serial}")
 
     logger.info("Starting ModuleThreadManager")
-    module_thread_manager = ModuleThreadManager(serial)
+    # Set by `robo_loader.server.main` from the command line
+    options = getattr(app.state, "manager_options", {})
+    module_thread_manager = ModuleThreadManager(serial, **options)
     module_thread_manager.start()
     app.state.module_thread_manager = module_thread_manager
 
@@ -65,12 +71,50 @@ def get_statuses(mtm: Mtm):
 def get_values(mtm: Mtm):
     return mtm.serial_reader_thread.values
 
+@app.get("/api/values/history")
+def get_values_history(
+    mtm: Mtm,
+    seconds: float = 300,
+    points: int = 200,
+    labels: Annotated[list[str] | None, Query()] = None,
+):
+    """Min, max and mean of each label in `points` buckets over the last
+    `seconds` seconds, for charts."""
+    labels = labels or SENSOR_LABELS
+    unknown = [label for label in labels if label not in SENSOR_LABELS]
+    if unknown:
+        return Response(status_code=400, content=f"Invalid labels: {unknown}")
+    if points < 1:
+        return Response(status_code=400, content=f"Invalid points: {points}")
+
+    history = mtm.sensor_history
+    return {
+        label: downsample(*history.times_and_values(label, seconds), points)
+        for label in labels
+    }
+
+
 @app.get("/api/photo.png")
-def get_photo(module_name: str):
-    photo_path = ROOT_PATH / "modules" / module_name / "PHOTO.png"
-    if not photo_path.exists():
+def get_photo(request: Request, module_name: str, size: PhotoSize = "medium"):
+    modules_path = ROOT_PATH / "modules"
+    photo_path = modules_path / module_name / "PHOTO.png"
+    if (
+        module_name in ("", ".", "..")
+        or Path(module_name).name != module_name
+        or not photo_path.resolve().is_relative_to(modules_path.resolve())
+        or not photo_path.exists()
+    ):
         return Response(status_code=400, content=f"{photo_path} does not exist")
-    return FileResponse(photo_path, media_type="image/png")
+
+    photo = Photo(photo_path, module_name, size)
+    # Falls back to the original if no thumbnail can be made, which the ETag
+    # and the media type have to follow
+    path = photo.path()
+    # A new upload changes the ETag, the browser checks again after a minute
+    headers = {"ETag": photo.etag, "Cache-Control": "public, max-age=60"}
+    if photo.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=photo.media_type, headers=headers)
 
 
 @app.get("/api/running_modules")
@@ -80,21 +124,100 @@ def get_running_modules(mtm: Mtm) -> list[str]:
 
 @app.get("/api/all_modules")
 def get_all_modules():
-    return [path.name for path in module_loader.get_module_paths()]
+    return list(get_catalog().entries())
+
+
+@app.get("/api/catalog")
+def get_module_catalog(request: Request):
+    etag, body = get_catalog().json()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 @app.get("/api/info")
 def info(mtm: Mtm):
-    return {module: ModuleInfo.to_str(info) for module, info in mtm.get_info().items()}
+    return mtm.get_info_strings()
+
+
+@app.get("/api/info/resources")
+def resources_info(mtm: Mtm):
+    """CPU and memory usage of every running module, sampled every second."""
+    return {
+        module: usage.to_json() for module, usage in mtm.get_resource_usage().items()
+    }
+
+
+@app.get("/api/metrics")
+def metrics():
+    return Response(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/api/info/switch")
+def switch_info(mtm: Mtm):
+    """Phase timings of the last module switches, the latest one last."""
+    return [switch.to_json() for switch in list(mtm.switches)]
+
+
+@app.get("/api/events")
+async def events(request: Request, mtm: Mtm, last_event_id: str | None = None):
+    """Server-sent events with every change of the polled endpoints' data.
+
+    A `snapshot` event with all of it comes first, unless the client resumes
+    from a `Last-Event-ID` (header or query) whose events are still kept.
+    """
+    hub = mtm.events
+    seq = hub.parse_id(request.headers.get("last-event-id") or last_event_id)
+
+    def snapshot() -> Event:
+        seq = hub.seq
+        return Event(
+            seq,
+            "snapshot",
+            {
+                "statuses": mtm.get_statuses(),
+                "values": (
+                    mtm.serial_reader_thread.values if mtm.serial_reader_thread else {}
+                ),
+                "info": mtm.get_info_strings(),
+                "running_modules": mtm.get_running_module_names(),
+            },
+        )
+
+    async def stream():
+        nonlocal seq
+        # Open streams would otherwise hold up the server's graceful shutdown
+        while not (hub.closed or mtm.cancel_event.is_set()):
+            if await request.is_disconnected():
+                break
+            pending = hub.since(seq) if seq is not None else None
+            if pending is None:
+                # Later events are replayed on top, they only overwrite
+                pending = [snapshot()]
+            elif not pending:
+                yield ": keep-alive\n\n"
+
+            for event in pending:
+                yield event.to_sse(hub.epoch)
+                seq = event.seq
+
+            await hub.wait(seq, timeout=15)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/api/module_author_mapping")
 def module_author_mapping():
-    def get_author(path: Path):
-        at = path / "AUTHOR.txt"
-        return at.read_text(encoding="utf-8") if at.exists() else path.name
-
-    return {path.name: get_author(path) for path in module_loader.get_module_paths()}
+    return {
+        name: entry.author or name for name, entry in get_catalog().entries().items()
+    }
 
 
 @app.post("/api/change_module")
@@ -102,10 +225,12 @@ def change_module(module_name: Annotated[str, Body(embed=True)], mtm: Mtm):
     if module_name == "Herkes":
         module_paths = module_loader.get_module_paths()
     else:
-        path = Path(ROOT_PATH) / "modules" / module_name
-        if not path.exists():
-            return Response(status_code=400, content=f"{path} does not exist")
-        module_paths = [path]
+        entry = get_catalog().get(module_name)
+        if entry is None:
+            return Response(
+                status_code=400, content=f"Module {module_name} does not exist"
+            )
+        module_paths = [entry.path]
 
     mtm.replace_thread(module_paths)
 
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Literal
+from uuid import uuid4
+
+EventKind = Literal["snapshot", "status", "values", "info", "running_modules", "reset"]
+
+
+@dataclass(frozen=True)
+class Event:
+    seq: int
+    kind: EventKind
+    data: Any
+
+    def to_sse(self, epoch: str) -> str:
+        data = json.dumps(self.data, ensure_ascii=False, default=str)
+        return f"id: {epoch}:{self.seq}\nevent: {self.kind}\ndata: {data}\n\n"
+
+
+class EventHub:
+    """Numbered changes for the dashboard. Publishers are threads, listeners
+    are the `/api/events` streams.
+
+    The last `history` events are kept so a client that reconnects can
+    continue from the last sequence number it has seen. Event ids are
+    `<epoch>:<seq>`, the epoch tells ids of an earlier server process apart.
+    """
+
+    def __init__(self, history: int = 4096) -> None:
+        self.epoch = uuid4().hex[:8]
+        self._events: deque[Event] = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.closed = False
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def publish(self, kind: EventKind, data: Any) -> None:
+        with self._lock:
+            self._seq += 1
+            self._events.append(Event(self._seq, kind, data))
+            waiters, self._waiters = self._waiters, []
+
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def close(self) -> None:
+        """Wakes the listeners for good, they end their streams.
+
+        Doesn't take the lock, it is called from a signal handler."""
+        self.closed = True
+        for loop, waiter in list(self._waiters):
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def parse_id(self, event_id: str | None) -> int | None:
+        """The sequence number of an event id of this hub, if it is one."""
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.partition(":")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def since(self, seq: int) -> list[Event] | None:
+        """Events after `seq`, `None` if some of them aren't kept anymore."""
+        with self._lock:
+            if seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            if not self._events or self._events[0].seq > seq + 1:
+                return None
+            return [event for event in self._events if event.seq > seq]
+
+    async def wait(self, seq: int, timeout: float) -> None:
+        """Waits until there are events after `seq` or `timeout` passes."""
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with self._lock:
+            if self._seq > seq or self.closed:
+                return
+            self._waiters.append((loop, waiter))
+
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if (loop, waiter) in self._waiters:
+                    self._waiters.remove((loop, waiter))
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
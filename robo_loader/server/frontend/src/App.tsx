@@ -4,6 +4,12 @@ import SingleModuleDisplay from "./SingleModuleDisplay"
 import StatusSelector from "./StatusSelector"
 import ValueDisplay from "./ValueDisplay"
 import RunningModules from "./RunningModules"
+import { useLiveUpdates } from "./hooks/apiClient"
+
+function LiveUpdates() {
+  useLiveUpdates()
+  return null
+}
 
 function App() {
   const [queryClient] = useState(() => new QueryClient())
@@ -11,6 +17,7 @@ function App() {
   return (
     <main className="text-center mx-auto mt-6">
       <QueryClientProvider client={queryClient}>
+        <LiveUpdates />
         <ValueDisplay />
         <StatusSelector />
         <RunningModules />
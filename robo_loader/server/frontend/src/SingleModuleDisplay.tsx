@@ -4,10 +4,13 @@ import type { Status } from "./types"
 
 export default function SingleModuleDisplay({ status }: { status: Status }) {
   const aiImage = useAIImage(status.author)
-  const photoUrl = useMemo(() => {
+  const [photoUrl, originalPhotoUrl] = useMemo(() => {
     const url = new URL("/api/photo.png", window.location.origin)
     url.searchParams.set("module_name", status.module_name)
-    return url.toString()
+    url.searchParams.set("size", "medium")
+    const original = new URL(url)
+    original.searchParams.set("size", "original")
+    return [url.toString(), original.toString()]
   }, [status.module_name])
 
   return (
@@ -21,7 +24,9 @@ export default function SingleModuleDisplay({ status }: { status: Status }) {
         <p>{status.content}</p>
       </div>
       <figure>
-        <img src={photoUrl} className="h-80 w-60" />
+        <a href={originalPhotoUrl} target="_blank">
+          <img src={photoUrl} className="h-80 w-60" />
+        </a>
       </figure>
     </div>
   )
@@ -1,5 +1,6 @@
 import type { Status } from "../types"
-import { useQuery } from "@tanstack/react-query"
+import { useQuery, useQueryClient } from "@tanstack/react-query"
+import { useEffect } from "react"
 
 export const useApiQuery = <T = any>(url: string, continuous: boolean = true) =>
   useQuery<T>({
@@ -12,10 +13,94 @@ export const useApiQuery = <T = any>(url: string, continuous: boolean = true) =>
     retry: continuous ? false : 3,
   })
 
-export const useStatuses = () => useApiQuery<Status[]>("statuses")
-export const useRunningModules = () => useApiQuery<string[]>("running_modules")
-export const useValues = () => useApiQuery<Record<string, number>>("values")
-export const useInfo = () => useApiQuery<Record<string, string>>("info")
+// Filled by useLiveUpdates instead of being fetched
+const useLiveData = <T>(key: string) =>
+  useQuery<T>({
+    queryKey: [key],
+    queryFn: () => Promise.reject(new Error(`${key} comes from /api/events`)),
+    enabled: false,
+  })
+
+// Set by useLiveUpdates when /api/events fails, cleared once it reconnects
+const CONNECTION_ERROR = "events_connection_error"
+
+const useLiveQuery = <T>(key: string) => {
+  const query = useLiveData<T>(key)
+  const error = useLiveData<Error | null>(CONNECTION_ERROR).data ?? null
+
+  // Nothing is fetched, so react-query never reports these by itself
+  if (error !== null) {
+    return { ...query, isLoading: false, isError: true as const, error }
+  }
+  return {
+    ...query,
+    isLoading: query.data === undefined,
+    isError: false as const,
+    error: null,
+  }
+}
+
+type Snapshot = {
+  statuses: Record<string, Status>
+  values: Record<string, number>
+  info: Record<string, string>
+  running_modules: string[]
+}
+
+export const useLiveUpdates = () => {
+  const queryClient = useQueryClient()
+
+  useEffect(() => {
+    // Reconnects by itself, resuming from the last event id it has seen
+    const source = new EventSource("/api/events")
+
+    const on = <T>(event: string, handler: (data: T) => void) =>
+      source.addEventListener(event, (e) =>
+        handler(JSON.parse((e as MessageEvent).data)),
+      )
+    const merge = <T extends object>(key: string, delta: T) =>
+      queryClient.setQueryData<T>([key], (old) => ({ ...old, ...delta }) as T)
+
+    on<Snapshot>("snapshot", (snapshot) => {
+      queryClient.setQueryData(["statuses"], snapshot.statuses)
+      queryClient.setQueryData(["values"], snapshot.values)
+      queryClient.setQueryData(["info"], snapshot.info)
+      queryClient.setQueryData(["running_modules"], snapshot.running_modules)
+    })
+    on<Record<string, Status>>("status", (delta) => merge("statuses", delta))
+    on<Record<string, number>>("values", (values) =>
+      queryClient.setQueryData(["values"], values),
+    )
+    on<Record<string, string>>("info", (delta) => merge("info", delta))
+    on<string[]>("running_modules", (modules) =>
+      queryClient.setQueryData(["running_modules"], modules),
+    )
+    source.addEventListener("open", () =>
+      queryClient.setQueryData([CONNECTION_ERROR], null),
+    )
+    source.addEventListener("error", () =>
+      queryClient.setQueryData(
+        [CONNECTION_ERROR],
+        new Error(
+          source.readyState === EventSource.CLOSED
+            ? "Canlı güncellemeler alınamıyor"
+            : "Sunucuyla bağlantı kesildi, yeniden bağlanılıyor",
+        ),
+      ),
+    )
+    on<null>("reset", () => {
+      queryClient.setQueryData(["statuses"], {})
+      queryClient.setQueryData(["info"], {})
+    })
+
+    return () => source.close()
+  }, [queryClient])
+}
+
+export const useStatuses = () => useLiveQuery<Record<string, Status>>("statuses")
+export const useRunningModules = () => useLiveQuery<string[]>("running_modules")
+export const useValues = () => useLiveQuery<Record<string, number>>("values")
+export const useInfo = () => useLiveQuery<Record<string, string>>("info")
 export const useAllModules = () => useApiQuery<string[]>("all_modules", false)
 
 export const useMAMapping = () => {
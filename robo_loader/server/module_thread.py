@@ -3,6 +3,7 @@ import multiprocessing.synchronize
 from pathlib import Path
 import queue
 import threading
+from typing import Callable
 
 from fastapi.datastructures import State
 from loguru import logger
@@ -10,7 +11,10 @@ from serial import Serial
 
 from robo_loader.impl.models import Identifier
 from robo_loader.impl.module_loader import ModuleLoader
-from robo_loader.impl.module_process import ModuleInfo
+from robo_loader.impl.module_process import InfoQueue
+from robo_loader.impl.resources import ResourceLimits
+from robo_loader.impl.sensor_history import SensorHistory
+from robo_loader.server.events import EventHub
 
 
 class Status(Identifier):
@@ -25,12 +29,25 @@ class ModuleThread(threading.Thread):
         self,
         module_paths: list[Path],
         serial_in: "queue.Queue[bytes] | None" = None,
-        info_queue: "multiprocessing.Queue[tuple[str, ModuleInfo]] | None" = None,
+        info_queue: "InfoQueue | None" = None,
+        events: EventHub | None = None,
+        on_exit: Callable[[], None] | None = None,
+        sensor_history: SensorHistory | None = None,
+        stop_timeout: float = 5.0,
+        resource_limits: ResourceLimits | None = None,
+        on_resources: Callable[[], None] | None = None,
     ):
         super().__init__()
         self.module_paths = module_paths
         self.serial_in = serial_in
         self.info_queue = info_queue
+        self.events = events
+        self.on_exit = on_exit
+        self.sensor_history = sensor_history
+        self.stop_timeout = stop_timeout
+        self.resource_limits = resource_limits
+        self.on_resources = on_resources
+        self.loader: ModuleLoader | None = None
 
         self.stop_event = multiprocessing.Event()
         self._values_queue = multiprocessing.Queue()
@@ -41,21 +58,46 @@ class ModuleThread(threading.Thread):
         logger.info("ModuleThread is running")
 
         def on_state_change(idf: Identifier, state: str):
+            status = Status(**idf, content=state)
             with self.status_lock:
-                self.statuses[idf["module_name"]] = Status(**idf, content=state)
-
-        ModuleLoader(
-            module_paths=self.module_paths,
-            on_state_change=on_state_change,
-            cancellation_event=self.stop_event,
-            ignore_deaths=True,
-            values_queue=self._values_queue,
-            serial_in=self.serial_in,
-            info_queue=self.info_queue,
-        ).load()
+                self.statuses[idf["module_name"]] = status
+            # After a reset, the dashboard only shows the next thread's modules
+            if self.events is not None and not self.stop_event.is_set():
+                self.events.publish("status", {idf["module_name"]: status})
+
+        try:
+            self.loader = ModuleLoader(
+                module_paths=self.module_paths,
+                on_state_change=on_state_change,
+                cancellation_event=self.stop_event,
+                ignore_deaths=True,
+                values_queue=self._values_queue,
+                serial_in=self.serial_in,
+                info_queue=self.info_queue,
+                sensor_history=self.sensor_history,
+                stop_timeout=self.stop_timeout,
+                resource_limits=self.resource_limits,
+                on_resources=self._on_resources,
+            )
+            self.loader.load()
+        finally:
+            if self.on_exit is not None:
+                self.on_exit()
+
+    def _on_resources(self) -> None:
+        if self.on_resources is not None and not self.stop_event.is_set():
+            self.on_resources()
 
     def set_values(self, values: dict):
         self._values_queue.put(values)
 
     def cancel(self):
         self.stop_event.set()
+
+    def kill(self) -> list[str]:
+        """Kills the module processes, for when cancelling didn't stop them."""
+        return self.loader.kill() if self.loader is not None else []
+
+    @property
+    def killed(self) -> list[str]:
+        return self.loader.killed if self.loader is not None else []
@@ -1,15 +1,33 @@
+from collections import deque
 from contextlib import suppress
+from dataclasses import dataclass, field
 import multiprocessing
 from pathlib import Path
 from queue import Empty
 import threading
+from time import monotonic, time
+from typing import Callable
 
 from loguru import logger
 from robo_loader.impl import transport
+from robo_loader.impl.sensor_history import SensorHistory
+from robo_loader.server.events import EventHub
 from robo_loader.server.module_thread import ModuleThread, Statuses
-from robo_loader.impl.module_process import InfoQueue
+from robo_loader.impl.module_process import InfoQueue, ModuleInfo
+from robo_loader.impl.resources import ResourceLimits, ResourceUsage
+from robo_loader.utils.metrics import registry
 from serial import Serial
 
+_serial_bytes = registry.counter(
+    "robo_serial_read_bytes_total", "Bytes read from the serial port"
+)
+_serial_writes = registry.counter(
+    "robo_serial_writes_total", "Commands written to the serial port"
+)
+_values_published = registry.counter(
+    "robo_serial_values_total", "Sensor frames passed on to the modules"
+)
+
 
 class SerialReaderThread(threading.Thread):
     def __init__(
@@ -29,6 +47,7 @@ class SerialReaderThread(threading.Thread):
             if self.serial.in_waiting > 0:
                 buf = self.serial.read_all()
                 if buf:
+                    _serial_bytes.inc(len(buf))
                     self.serial_buffer += buf
                     if b"\n" in self.serial_buffer:
                         line, self.serial_buffer = self.serial_buffer.split(b"\n", 1)
@@ -37,42 +56,160 @@ class SerialReaderThread(threading.Thread):
                         self.values = values
                         logger.info(f"SerialReaderThread values: {values}")
                         self.mtm.set_values(values)
+                        if values is not None:
+                            _values_published.inc()
+                            self.mtm.sensor_history.append(values)
+                            self.mtm.events.publish("values", values)
 
             try:
                 data = self.serial_in.get_nowait()
                 self.serial.write(data)
+                _serial_writes.inc()
             except Empty:
                 pass
 
 
 class InfoReaderThread(threading.Thread):
-    def __init__(self, info_queue: "InfoQueue", cancel_event: threading.Event) -> None:
+    def __init__(
+        self,
+        info_queue: "InfoQueue",
+        cancel_event: threading.Event,
+        events: EventHub | None = None,
+        on_info: Callable[[str, ModuleInfo], None] | None = None,
+        describe: Callable[[str], str] | None = None,
+        is_current: Callable[[str], bool] | None = None,
+    ) -> None:
         super().__init__()
         self.info_queue = info_queue
         self.cancel_event = cancel_event
+        self.events = events
+        self.on_info = on_info
+        self.describe = describe
+        self.is_current = is_current
         self.info = {}
+        self.queue_positions: dict[str, int] = {}
 
     def reset(self) -> None:
         self.info.clear()
+        self.queue_positions.clear()
 
     def run(self) -> None:
         while not self.cancel_event.is_set():
             with suppress(Empty):
-                module_name, module_info = self.info_queue.get(timeout=1)
+                module_name, module_info, position = self.info_queue.get(timeout=1)
+                if self.on_info is not None:
+                    self.on_info(module_name, module_info)
+                # Left over from modules that were reset, unless they run again
+                if self.is_current is not None and not self.is_current(module_name):
+                    continue
+
                 self.info[module_name] = module_info
+                if position is None:
+                    self.queue_positions.pop(module_name, None)
+                else:
+                    self.queue_positions[module_name] = position
+
+                if self.events is not None:
+                    text = (
+                        self.describe(module_name)
+                        if self.describe is not None
+                        else ModuleInfo.to_str(module_info, position)
+                    )
+                    self.events.publish("info", {module_name: text})
+
+
+_FINAL_INFOS = (ModuleInfo.RUNNING, ModuleInfo.STOPPED, ModuleInfo.ERRORED)
+
+
+@dataclass
+class SwitchTimings:
+    """How long each phase of a module switch took, in seconds.
+
+    `stop`: the previous modules exiting, including the loader killing the
+    ones that ignored termination. `kill`: only there if the manager had to
+    kill them itself. `spawn`: every new module process started. `ready`:
+    every new module running or failed.
+    """
+
+    modules: list[str]
+    started_at: float = field(default_factory=time)
+    phases: dict[str, float] = field(default_factory=dict)
+    killed: list[str] = field(default_factory=list)
+    # Previous loaders still stopping when the new one started
+    overlapping: int = 0
+
+    _last: float = field(default_factory=monotonic, repr=False)
+    _started: set[str] = field(default_factory=set, repr=False)
+    _finished: set[str] = field(default_factory=set, repr=False)
+
+    def mark(self, phase: str) -> None:
+        now = monotonic()
+        self.phases[phase] = now - self._last
+        self._last = now
+
+    def on_info(self, module_name: str, info: ModuleInfo) -> None:
+        if module_name not in self.modules:
+            return
+
+        # Infos of the previous run of the same module can still be queued
+        if info == ModuleInfo.STARTING:
+            self._started.add(module_name)
+            if len(self._started) == len(self.modules) and "spawn" not in self.phases:
+                self.mark("spawn")
+        elif info in _FINAL_INFOS and module_name in self._started:
+            self._finished.add(module_name)
+            if len(self._finished) == len(self.modules) and "ready" not in self.phases:
+                self.mark("ready")
+
+    def to_json(self) -> dict:
+        return {
+            "modules": self.modules,
+            "started_at": self.started_at,
+            "phases": dict(self.phases),
+            "killed": list(self.killed),
+            "overlapping": self.overlapping,
+        }
 
 
 class ModuleThreadManager:
-    def __init__(self, serial: Serial | None) -> None:
+    # Extra time given to the loaders after their own stop timeout
+    KILL_GRACE = 2.0
+
+    def __init__(
+        self,
+        serial: Serial | None,
+        stop_timeout: float = 5.0,
+        max_overlap: int = 0,
+        resource_limits: ResourceLimits | None = None,
+    ) -> None:
+        """Switching modules waits until at most `max_overlap` previous
+        loaders are still stopping, killing their modules if they take
+        longer than `stop_timeout`. `resource_limits` apply to every module."""
+        self.stop_timeout = stop_timeout
+        self.max_overlap = max_overlap
+        self.resource_limits = resource_limits
         self.cancel_event = threading.Event()
+        self.events = EventHub()
+        self.sensor_history = SensorHistory.create()
         self.serial_reader_thread = serial and SerialReaderThread(
             serial, self.cancel_event, self
         )
 
         self.info_queue = multiprocessing.Queue()
-        self.info_reader_thread = InfoReaderThread(self.info_queue, self.cancel_event)
+        self.info_reader_thread = InfoReaderThread(
+            self.info_queue,
+            self.cancel_event,
+            self.events,
+            self._on_info,
+            self.describe_module,
+            self._is_current,
+        )
 
         self.threads: list[ModuleThread] = []
+        # Cancelled, not yet exited
+        self.stopping: list[ModuleThread] = []
+        self.switches: deque[SwitchTimings] = deque(maxlen=20)
+        self._switch_lock = threading.Lock()
 
     def set_values(self, values: dict | None) -> None:
         if values is None:
@@ -90,8 +227,53 @@ class ModuleThreadManager:
             self.serial_reader_thread.start()
 
     def replace_thread(self, module_paths: list[Path]):
-        self.cancel_threads()
-        self.add_thread(module_paths)
+        with self._switch_lock:
+            switch = SwitchTimings([path.name for path in module_paths])
+            self.cancel_threads()
+            self.wait_for_stopping(switch)
+            self.switches.append(switch)
+            self.add_thread(module_paths)
+
+    def wait_for_stopping(self, switch: SwitchTimings | None = None) -> None:
+        """Waits until at most `max_overlap` cancelled threads are alive,
+        killing their modules if they don't stop in time."""
+
+        def wait(timeout: float) -> bool:
+            deadline = monotonic() + timeout
+            for thread in self.stopping:
+                if sum(t.is_alive() for t in self.stopping) <= self.max_overlap:
+                    break
+                thread.join(max(0.0, deadline - monotonic()))
+            return sum(t.is_alive() for t in self.stopping) <= self.max_overlap
+
+        stopped = wait(self.stop_timeout + self.KILL_GRACE)
+        if switch is not None:
+            switch.mark("stop")
+
+        if not stopped:
+            killed = [name for t in self.stopping if t.is_alive() for name in t.kill()]
+            logger.warning(f"Killed {killed}, they didn't stop in time.")
+            if not wait(self.KILL_GRACE):
+                logger.error("Module threads are still alive after killing them.")
+            if switch is not None:
+                switch.mark("kill")
+
+        if switch is not None:
+            switch.killed = [name for t in self.stopping for name in t.killed]
+        self.stopping = [t for t in self.stopping if t.is_alive()]
+        if switch is not None:
+            switch.overlapping = len(self.stopping)
+
+    def _is_current(self, module_name: str) -> bool:
+        return any(
+            path.name == module_name
+            for thread in list(self.threads)
+            for path in thread.module_paths
+        )
+
+    def _on_info(self, module_name: str, info: ModuleInfo) -> None:
+        if self.switches:
+            self.switches[-1].on_info(module_name, info)
 
     def add_thread(self, module_paths: list[Path]):
         serial_in = self.serial_reader_thread and self.serial_reader_thread.serial_in
@@ -103,30 +285,93 @@ class ModuleThreadManager:
             module_paths=module_paths,
             serial_in=serial_in,
             info_queue=self.info_queue,
+            events=self.events,
+            on_exit=self.publish_running_modules,
+            sensor_history=self.sensor_history,
+            stop_timeout=self.stop_timeout,
+            resource_limits=self.resource_limits,
+            on_resources=self.publish_info,
         )
 
         self.threads.append(thread)
         thread.start()
+        self.publish_running_modules()
         logger.info(f"Started thread for {module_paths}")
 
     def cancel_threads(self) -> None:
         while self.threads:
             thread = self.threads.pop()
             thread.cancel()
+            self.stopping.append(thread)
 
         self.info_reader_thread.reset()
+        self.events.publish("reset", None)
 
     def get_running_module_names(self) -> list[str]:
         return [
             module_path.name
             for thread in self.threads
             if thread.is_alive()
+            # Still alive while it reports its own exit
+            and thread is not threading.current_thread()
             for module_path in thread.module_paths
         ]
 
+    def publish_running_modules(self) -> None:
+        self.events.publish("running_modules", self.get_running_module_names())
+
     def cancel(self):
         self.cancel_threads()
+        self.max_overlap = 0
+        self.wait_for_stopping()
         self.cancel_event.set()
+        self.events.close()
+        # It appends to the history, which must outlive it
+        if self.serial_reader_thread:
+            self.serial_reader_thread.join()
+        self.sensor_history.close()
 
     def get_info(self):
         return self.info_reader_thread.info
+
+    def get_queue_positions(self) -> dict[str, int]:
+        return self.info_reader_thread.queue_positions
+
+    def get_resource_usage(self) -> dict[str, ResourceUsage]:
+        return {
+            name: usage
+            for thread in list(self.threads)
+            if thread.loader is not None
+            for name, usage in thread.loader.resources.usage.items()
+        }
+
+    def _stop_reason(self, module_name: str) -> str | None:
+        for thread in list(self.threads):
+            if thread.loader is not None:
+                reason = thread.loader.resources.stopped.get(module_name)
+                if reason is not None:
+                    return reason
+        return None
+
+    def describe_module(self, module_name: str) -> str:
+        """The module's info for the dashboard, with its resource usage."""
+        info = self.get_info().get(module_name)
+        if info is None:
+            return ModuleInfo.to_str(ModuleInfo.STARTING)
+        text = ModuleInfo.to_str(info, self.get_queue_positions().get(module_name))
+
+        if info == ModuleInfo.OVER_BUDGET:
+            reason = self._stop_reason(module_name)
+            return f"{text}: {reason}" if reason else text
+
+        usage = self.get_resource_usage().get(module_name)
+        if usage is not None and info == ModuleInfo.RUNNING:
+            text = f"{text} ({usage.to_str()})"
+        return text
+
+    def get_info_strings(self) -> dict[str, str]:
+        modules = list(self.get_info())
+        return {module: self.describe_module(module) for module in modules}
+
+    def publish_info(self) -> None:
+        self.events.publish("info", self.get_info_strings())
@@ -0,0 +1,118 @@
+import os
+import threading
+from pathlib import Path
+from typing import Literal
+from uuid import uuid4
+
+from loguru import logger
+
+from robo_loader import ROOT_PATH
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+
+cache_path = ROOT_PATH / ".photo_cache"
+
+PhotoSize = Literal["small", "medium", "large", "original"]
+
+# Longest side of the thumbnails in pixels
+THUMBNAIL_SIZES: dict[str, int] = {"small": 160, "medium": 480, "large": 1080}
+
+# (module name, version) of the photos that couldn't be decoded
+_undecodable: set[tuple[str, str]] = set()
+
+
+class Photo:
+    """A module's `PHOTO.png` at one of the thumbnail sizes or as uploaded.
+
+    Thumbnails are JPEG files in the module's directory in `cache_path`,
+    named after the source's mtime and size so a new upload never hits an old
+    thumbnail. A photo that
+    can't be decoded is served as uploaded until a new one is.
+    """
+
+    def __init__(self, source: Path, module_name: str, size: PhotoSize) -> None:
+        self.source = source
+        self.module_name = module_name
+        self.size = size
+
+        stat = source.stat()
+        self.version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        if (module_name, self.version) in _undecodable:
+            self.size = "original"
+
+    @property
+    def etag(self) -> str:
+        """Of the size that is served, which `path` may change."""
+        return f'"{self.size}-{self.version}"'
+
+    @property
+    def media_type(self) -> str:
+        return "image/png" if self.size == "original" else "image/jpeg"
+
+    @property
+    def cached_path(self) -> Path:
+        return cache_path / self.module_name / f"{self.size}.{self.version}.jpg"
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """Whether the client's copy, by its `If-None-Match`, is this one."""
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags
+
+    def path(self) -> Path:
+        """The file to serve, creating the thumbnail if it isn't cached."""
+        if self.size == "original":
+            return self.source
+
+        cached = self.cached_path
+        if not cached.exists():
+            with _lock_for(cached):
+                if not cached.exists():
+                    try:
+                        self._create_thumbnail(cached)
+                    except Exception as e:
+                        logger.warning(
+                            f"Couldn't make a thumbnail of {self.source}: {e}"
+                        )
+                        _undecodable.add((self.module_name, self.version))
+                        self.size = "original"
+                        return self.source
+        return cached
+
+    def _create_thumbnail(self, target: Path) -> None:
+        import pygame
+
+        image = pygame.image.load(str(self.source))
+        # JPEG has no transparency, it would turn black. This also gives
+        # smoothscale the 24 bit surface it needs.
+        flattened = pygame.Surface(image.get_size(), 0, 24)
+        flattened.fill((255, 255, 255))
+        flattened.blit(image, (0, 0))
+        image = flattened
+
+        width, height = image.get_size()
+        scale = min(1.0, THUMBNAIL_SIZES[self.size] / max(width, height))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        thumbnail = pygame.transform.smoothscale(image, size)
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # pygame picks the format by the extension, keep it on the temporary file
+        temp = target.parent / f".{uuid4().hex}.jpg"
+        pygame.image.save(thumbnail, str(temp))
+        os.replace(temp, target)
+
+        # Thumbnails of earlier uploads aren't going to be asked for again
+        for old in target.parent.iterdir():
+            if old.name.startswith(f"{self.size}.") and old != target:
+                old.unlink(missing_ok=True)
+
+
+_locks: dict[Path, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def _lock_for(path: Path) -> threading.Lock:
+    # The dashboard asks for the same photo from every open tab at once
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
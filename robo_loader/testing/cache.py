@@ -0,0 +1,131 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+from loguru import logger
+
+from robo_loader import ROOT_PATH
+from robo_loader.testing.test_model import TestInput, TestMeta
+from robo_loader.utils.manifest import FileManifest
+
+_IGNORED_DIRS = {"__pycache__", "__MACOSX", ".git"}
+# `TestStatus.PASSED.name`, results are stored as JSON
+_PASSED = "PASSED"
+# Where unzip installs modules, the origins in the manifest are of these
+modules_path = (ROOT_PATH / "modules").resolve()
+
+
+def hash_tree(module_path: Path, manifest: FileManifest | None = None) -> str:
+    """Hashes the file names and contents of a module, except requirements.txt
+    which is hashed separately. File hashes come from `manifest` if given.
+
+    A module that `manifest` knows was extracted from an archive is hashed by
+    that archive instead. Modules run in their own directory, whatever they
+    write there would otherwise make every run invalidate its own cache.
+    """
+    if manifest is not None and module_path.parent.resolve() == modules_path:
+        origin = manifest.origin(module_path.name)
+        if origin is not None:
+            return f"archive:{origin.archive_hash}"
+
+    hash_sha = hashlib.sha256()
+    files = sorted(
+        p
+        for p in module_path.rglob("*")
+        if p.is_file()
+        and not _IGNORED_DIRS.intersection(p.relative_to(module_path).parts)
+        and p.relative_to(module_path) != Path("requirements.txt")
+    )
+    for file in files:
+        hash_sha.update(file.relative_to(module_path).as_posix().encode("utf-8"))
+        hash_sha.update(b"\0")
+        file_hash = manifest.fast_hash(file) if manifest else hash_file(file)
+        hash_sha.update(file_hash.encode("ascii"))
+    return hash_sha.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    if not path.exists():
+        return ""
+
+    hash_sha = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hash_sha.update(chunk)
+    return hash_sha.hexdigest()
+
+
+class TestCache:
+    """Stores test results and logs keyed by the hashes of the test's inputs,
+    so unchanged modules don't have to be tested again.
+
+    Only passes are kept. A failure may come from the environment (pip, the
+    network, a flaky load) rather than the inputs, so it is tested again.
+    """
+
+    cache_path: Path
+
+    def __init__(
+        self,
+        cache_path: Path,
+        suite_version: int,
+        manifest: FileManifest | None = None,
+    ) -> None:
+        self.cache_path = cache_path
+        self.suite_version = suite_version
+        self.manifest = manifest
+
+    def input_hashes(self, module_path: Path) -> dict[TestInput, str]:
+        return {
+            "tree": hash_tree(module_path, self.manifest),
+            "requirements": hash_file(module_path / "requirements.txt"),
+        }
+
+    def key(self, meta: TestMeta, input_hashes: dict[TestInput, str]) -> str:
+        hash_sha = hashlib.sha256(f"{self.suite_version}:{meta.name}".encode())
+        for test_input in sorted(meta.inputs):
+            hash_sha.update(f":{test_input}={input_hashes[test_input]}".encode())
+        return hash_sha.hexdigest()
+
+    def _entry_path(self, module_path: Path, meta: TestMeta) -> Path:
+        return self.cache_path / module_path.name / meta.name
+
+    def load(
+        self, module_path: Path, meta: TestMeta, key: str, logs_path: Path
+    ) -> dict | None:
+        """Returns the cached result and copies its logs into `logs_path`."""
+        entry_path = self._entry_path(module_path, meta)
+        try:
+            entry = json.loads((entry_path / "result.json").read_text("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("key") != key or entry.get("status") != _PASSED:
+            return None
+
+        for log in (entry_path / "logs").glob("*"):
+            shutil.copy(log, logs_path / log.name)
+
+        return entry
+
+    def store(
+        self, module_path: Path, meta: TestMeta, key: str, entry: dict, logs_path: Path
+    ) -> None:
+        entry_path = self._entry_path(module_path, meta)
+        if entry["status"] != _PASSED:
+            return
+
+        try:
+            if entry_path.exists():
+                shutil.rmtree(entry_path)
+            (entry_path / "logs").mkdir(parents=True)
+
+            for log in logs_path.glob(f"{meta.name}.*"):
+                shutil.copy(log, entry_path / "logs" / log.name)
+
+            (entry_path / "result.json").write_text(
+                json.dumps({**entry, "key": key}), encoding="utf-8"
+            )
+        except OSError:
+            logger.exception(f"Could not cache {meta.name} for {module_path.name}")
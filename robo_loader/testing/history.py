@@ -0,0 +1,138 @@
+import sqlite3
+import statistics
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+from robo_loader.testing.runner import TestResults, TestStatus
+
+# Measurements of the whole suite are stored under this module name
+SUITE = ""
+
+PhaseTimings = dict[Path, dict[str, float]]
+
+
+@dataclass(frozen=True)
+class Regression:
+    module: str
+    metric: str
+    duration: float
+    baseline: float
+
+
+class TestHistory:
+    """Keeps the durations of every test_all run in a SQLite file.
+
+    Metrics are `test:<test name>`, `phase:<startup phase>` and `total` for
+    modules, and `wall` for the whole suite. Cached results aren't recorded
+    since they weren't measured in that run, nor are tests that didn't run.
+    The `total` of a module is only recorded when all of its tests ran, it
+    would otherwise only be comparable to runs that skipped the same ones.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        self.connection = sqlite3.connect(db_path)
+        with self.connection:
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS measurements (
+                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                    module TEXT NOT NULL,
+                    metric TEXT NOT NULL,
+                    status TEXT,
+                    duration REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS measurements_module_metric
+                    ON measurements (module, metric, run_id);
+                """
+            )
+
+    def record(
+        self,
+        results: dict[Path, TestResults],
+        phase_timings: PhaseTimings,
+        wall_time: float | None = None,
+    ) -> int:
+        rows: list[tuple[str, str, str | None, float]] = []
+        for module_path, test_results in results.items():
+            measured = {
+                test: result
+                for test, result in test_results.items()
+                if not result.cached and result.status is not TestStatus.NOT_RUN
+            }
+            for test, result in measured.items():
+                rows.append(
+                    (
+                        module_path.name,
+                        f"test:{test.name}",
+                        result.status.name,
+                        result.duration,
+                    )
+                )
+            if len(measured) == len(test_results):
+                total = sum(result.duration for result in measured.values())
+                rows.append((module_path.name, "total", None, total))
+
+        for module_path, timings in phase_timings.items():
+            for phase, duration in timings.items():
+                rows.append((module_path.name, f"phase:{phase}", None, duration))
+
+        if wall_time is not None:
+            rows.append((SUITE, "wall", None, wall_time))
+
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started_at) VALUES (?)",
+                (datetime.now().isoformat(),),
+            ).lastrowid
+            assert run_id is not None
+            self.connection.executemany(
+                "INSERT INTO measurements VALUES (?, ?, ?, ?, ?)",
+                [(run_id, *row) for row in rows],
+            )
+
+        return run_id
+
+    def regressions(
+        self,
+        run_id: int,
+        window: int = 10,
+        min_samples: int = 3,
+        ratio: float = 1.5,
+        min_difference: float = 1.0,
+    ) -> list[Regression]:
+        """Measurements of `run_id` that are at least `ratio` times and
+        `min_difference` seconds slower than the median of the previous
+        `window` runs."""
+        rv = []
+        current = self.connection.execute(
+            "SELECT module, metric, duration FROM measurements WHERE run_id = ?",
+            (run_id,),
+        ).fetchall()
+        for module, metric, duration in current:
+            history = [
+                row[0]
+                for row in self.connection.execute(
+                    """
+                    SELECT duration FROM measurements
+                    WHERE module = ? AND metric = ? AND run_id < ?
+                    ORDER BY run_id DESC LIMIT ?
+                    """,
+                    (module, metric, run_id, window),
+                )
+            ]
+            if len(history) < min_samples:
+                continue
+
+            baseline = statistics.median(history)
+            if duration >= baseline * ratio and duration - baseline >= min_difference:
+                rv.append(Regression(module, metric, duration, baseline))
+
+        return rv
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import monotonic
+
+from robo_loader.testing.test_model import TestResource
+
+
+def load_ratio() -> float | None:
+    """1 minute load average per CPU, `None` where it isn't available."""
+    if not hasattr(os, "getloadavg"):
+        return None
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+def available_memory_mb() -> int | None:
+    try:
+        with open("/proc/meminfo", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class AdaptiveLimiter:
+    """Limits how many tests of each resource profile run at the same time.
+
+    I/O tests always get their base limit. CPU and process heavy tests get
+    fewer slots as the load average rises above the CPU count, and process
+    heavy ones also need `memory_per_process_mb` of available memory each.
+    """
+
+    def __init__(
+        self,
+        base_limits: dict[TestResource, int] | None = None,
+        memory_per_process_mb: int = 512,
+    ) -> None:
+        cpus = os.cpu_count() or 4
+        self.base_limits: dict[TestResource, int] = base_limits or {
+            "io": 32,
+            "cpu": cpus,
+            "process": max(1, cpus // 2),
+        }
+        self.memory_per_process_mb = memory_per_process_mb
+
+        self._running: Counter[TestResource] = Counter()
+        self._condition = threading.Condition()
+        self._limits: dict[TestResource, int] = dict(self.base_limits)
+        self._limits_updated_at = 0.0
+
+    @contextmanager
+    def slot(self, resource: TestResource):
+        with self._condition:
+            while self._running[resource] >= self.limit(resource):
+                self._condition.wait(1)
+            self._running[resource] += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._running[resource] -= 1
+                self._condition.notify_all()
+
+    def limit(self, resource: TestResource) -> int:
+        if monotonic() - self._limits_updated_at > 1:
+            self._limits = self._compute_limits()
+            self._limits_updated_at = monotonic()
+        return self._limits[resource]
+
+    def _compute_limits(self) -> dict[TestResource, int]:
+        limits = dict(self.base_limits)
+
+        load = load_ratio()
+        if load is not None and load > 1:
+            for resource in ("cpu", "process"):
+                limits[resource] = int(limits[resource] / load)
+
+        memory = available_memory_mb()
+        if memory is not None:
+            limits["process"] = min(
+                limits["process"], memory // self.memory_per_process_mb
+            )
+
+        # Something has to run, otherwise nothing ever frees up
+        return {resource: max(1, limit) for resource, limit in limits.items()}
@@ -0,0 +1,76 @@
+import queue
+import threading
+from pathlib import Path
+
+
+class BufferedLogWriter:
+    """Writes a test's log file from a background thread.
+
+    The file is opened once for appending, the module process appends to
+    the same file. At most `max_pending` messages are buffered (writers
+    block when it is full) and everything after the first `max_bytes` bytes
+    is dropped. If the thread has died, messages are written directly.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_pending: int = 10_000,
+        max_bytes: int | None = None,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self._queue: "queue.Queue[str | None]" = queue.Queue(max_pending)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name=f"BufferedLogWriter-{path.name}", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, message: str | None) -> bool:
+        """Queues `message`, returns `False` if the thread isn't there to
+        take it anymore."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(message, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def write(self, message: str) -> None:
+        if self._closed:
+            return
+        if not self._put(message):
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(message)
+
+    def close(self) -> None:
+        """Flushes the pending messages and closes the file."""
+        if self._closed:
+            return
+
+        self._closed = True
+        if self._put(None):
+            self._thread.join()
+
+    def _run(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        written = 0
+        truncated = False
+        with self.path.open("a", encoding="utf-8") as f:
+            while (message := self._queue.get()) is not None:
+                if truncated:
+                    continue
+
+                size = len(message.encode("utf-8"))
+                if self.max_bytes is not None and written + size > self.max_bytes:
+                    f.write(f"... (log {self.max_bytes} bayttan sonra kesildi)\n")
+                    truncated = True
+                    continue
+
+                f.write(message)
+                written += size
+                if self._queue.empty():
+                    f.flush()
@@ -1,12 +1,21 @@
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
+import sqlite3
 from threading import Lock
+from time import perf_counter
 from typing import TYPE_CHECKING, cast
 
 from loguru import logger
+from robo_loader.testing.cache import TestCache
+from robo_loader.testing.limiter import AdaptiveLimiter
+from robo_loader.testing.log_writer import BufferedLogWriter
+from robo_loader.testing.session import ModuleSession
 from robo_loader.testing.test_model import Test, TestContext, TestMeta
 from robo_loader.testing.unit_tests import tests
+from robo_loader.utils.proc import ProcessGroup, current_process_group
 
 if TYPE_CHECKING:
     from loguru import Message
@@ -16,84 +25,234 @@ class TestStatus(Enum):
     PASSED = object()
     FAILED = object()
     NOT_RUN = object()
+    TIMED_OUT = object()
 
 
 @dataclass(frozen=True)
 class TestResult:
     status: TestStatus
     message: str = ""
+    duration: float = 0.0
+    cached: bool = False
+
+    def to_json(self) -> dict:
+        return {
+            "status": self.status.name,
+            "message": self.message,
+            "duration": self.duration,
+            "cached": self.cached,
+        }
+
+    @staticmethod
+    def from_json(data: dict, cached: bool = False) -> "TestResult":
+        """`cached` marks the result as cached whatever `data` says."""
+        return TestResult(
+            TestStatus[data["status"]],
+            data["message"],
+            data["duration"],
+            cached or data.get("cached", False),
+        )
 
 
 TestResults = dict[TestMeta, TestResult]
 
+
+@dataclass(eq=False)
+class _RunningTest:
+    meta: TestMeta
+    timeout: float
+    process_group: ProcessGroup = field(default_factory=ProcessGroup)
+    # Set once a worker picks the test up
+    started_at: float | None = None
+
+    def time_left(self) -> float:
+        if self.started_at is None:
+            return self.timeout
+        return max(0, self.started_at + self.timeout - perf_counter())
+
+
 logger_setup_lock = Lock()
 
 
 class TestRunner:
     logs_path: Path
+    # Startup phase durations of the last run's module session
+    phase_timings: dict[str, float]
 
-    def __init__(self, logs_path: Path) -> None:
+    def __init__(
+        self,
+        logs_path: Path,
+        max_workers: int = 4,
+        cache: TestCache | None = None,
+        simulate: bool = True,
+        max_log_bytes: int | None = None,
+        default_timeout: float = 300,
+        limiter: AdaptiveLimiter | None = None,
+    ) -> None:
         self.logs_path = logs_path
+        self.max_workers = max_workers
+        self.cache = cache
+        self.simulate = simulate
+        self.max_log_bytes = max_log_bytes
+        self.default_timeout = default_timeout
+        self.limiter = limiter
+        self.phase_timings = {}
         if not self.logs_path.exists():
             self.logs_path.mkdir()
 
     def run(self, module_path: Path):
+        """Runs the tests as a dependency graph, a test is started as soon as
+        all of its dependencies are resolved."""
         self._setup_logger()
 
         results: TestResults = {}
-        test_queue = tests.tests.copy()
-
-        while test_queue:
-            test = test_queue.pop(0)
+        dependents: dict[TestMeta, list[Test]] = {t.test_meta: [] for t in tests.tests}
+        unresolved: dict[TestMeta, int] = {}
+        for test in tests.tests:
             meta = test.test_meta
+            unresolved[meta] = len(meta.dependencies)
+            for dep in meta.dependencies:
+                dependents[dep.test_meta].append(test)
+
+        session = ModuleSession(
+            module_path, tests.expectations, self.simulate, self.limiter
+        )
+        cache = self.cache
+        input_hashes = {}
+        if cache is not None:
+            try:
+                input_hashes = cache.input_hashes(module_path)
+            except (OSError, sqlite3.Error):
+                # Testing without the cache is slower, not wrong
+                logger.exception(f"Could not hash {module_path.name}, not caching")
+                cache = None
+        cache_keys: dict[TestMeta, str] = {}
+
+        executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix=f"TestRunner-{module_path.name}",
+        )
+        try:
+            running: dict[Future[TestResult], _RunningTest] = {}
 
-            # If the test has no dependencies, run it immediately
-            if not meta.dependencies:
-                result = self._run_test(test, module_path)
+            def resolve(meta: TestMeta, result: TestResult):
                 results[meta] = result
-                continue
-
-            unresolved_dependencies = [
-                dep.test_meta
-                for dep in meta.dependencies
-                if dep.test_meta not in results
-            ]
-            # If the test has unresolved dependencies, defer it
-            if unresolved_dependencies:
-                test_queue.append(test)
-                continue
-
-            failed_dependencies = [
-                dep.test_meta
-                for dep in meta.dependencies
-                if results[dep.test_meta].status is not TestStatus.PASSED
-            ]
-            # If the test has failed dependencies, mark it as not run
-            if failed_dependencies:
-                fd_repr = ", ".join([dep.name for dep in failed_dependencies])
-                results[meta] = TestResult(
-                    TestStatus.NOT_RUN,
-                    f"Çalıştırılmadı. Başarısız gereksinimler: {fd_repr}",
+                for dependent in dependents[meta]:
+                    unresolved[dependent.test_meta] -= 1
+                    if unresolved[dependent.test_meta] == 0:
+                        schedule(dependent)
+
+            def schedule(test: Test):
+                meta = test.test_meta
+                failed_dependencies = [
+                    dep.test_meta
+                    for dep in meta.dependencies
+                    if results[dep.test_meta].status is not TestStatus.PASSED
+                ]
+                # If the test has failed dependencies, mark it as not run
+                if failed_dependencies:
+                    fd_repr = ", ".join([dep.name for dep in failed_dependencies])
+                    resolve(
+                        meta,
+                        TestResult(
+                            TestStatus.NOT_RUN,
+                            f"Çalıştırılmadı. Başarısız gereksinimler: {fd_repr}",
+                        ),
+                    )
+                    return
+
+                if cache:
+                    cache_keys[meta] = cache.key(meta, input_hashes)
+                    cached = cache.load(
+                        module_path, meta, cache_keys[meta], self.logs_path
+                    )
+                    if cached is not None:
+                        resolve(meta, TestResult.from_json(cached, cached=True))
+                        return
+
+                running_test = _RunningTest(meta, meta.timeout or self.default_timeout)
+                future = executor.submit(
+                    self._run_test, test, module_path, session, running_test
                 )
-                continue
+                running[future] = running_test
 
-            # If the test has passed dependencies, run it
-            result = self._run_test(test, module_path)
-            results[meta] = result
+            for test in tests.tests:
+                if not test.test_meta.dependencies:
+                    schedule(test)
+
+            while running:
+                done, _ = wait(
+                    running,
+                    timeout=min(rt.time_left() for rt in running.values()),
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
+                    meta, result = running.pop(future).meta, future.result()
+                    if cache and meta in cache_keys:
+                        cache.store(
+                            module_path,
+                            meta,
+                            cache_keys[meta],
+                            result.to_json(),
+                            self.logs_path,
+                        )
+                    resolve(meta, result)
 
-        return results
+                for future, running_test in list(running.items()):
+                    if running_test.time_left() > 0:
+                        continue
 
-    def _run_test(self, test: Test, module_path: Path):
+                    # The test's thread is abandoned, killing its processes
+                    # is what makes it return eventually.
+                    logger.warning(f"{running_test.meta.name} timed out, killing it")
+                    running_test.process_group.kill()
+                    del running[future]
+                    resolve(
+                        running_test.meta,
+                        TestResult(
+                            TestStatus.TIMED_OUT,
+                            f"Zaman aşımı: {running_test.timeout:g} saniyede bitmedi.",
+                            running_test.timeout,
+                        ),
+                    )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        self.phase_timings = session.phase_timings
+        return {test.test_meta: results[test.test_meta] for test in tests.tests}
+
+    def _run_test(
+        self,
+        test: Test,
+        module_path: Path,
+        session: ModuleSession,
+        running_test: "_RunningTest",
+    ):
         meta = test.test_meta
 
-        log_file = self.logs_path / f"{meta.name}.log"
-        try:
-            with logger.contextualize(_test_runner_log_file=log_file):
-                ctx = TestContext(module_path, log_file)
-                test(ctx)
-            return TestResult(TestStatus.PASSED)
-        except Exception as e:
-            return TestResult(TestStatus.FAILED, str(e))
+        # Session tests share one slot, the module is loaded once for them all
+        if meta.uses_session:
+            slot = session.slot()
+        elif self.limiter is not None:
+            slot = self.limiter.slot(meta.resource)
+        else:
+            slot = nullcontext()
+
+        # Admitted first, the test's time starts inside
+        with slot:
+            log_file = self.logs_path / f"{meta.name}.log"
+            log_writer = BufferedLogWriter(log_file, max_bytes=self.max_log_bytes)
+            current_process_group.set(running_test.process_group)
+            running_test.started_at = start = perf_counter()
+            try:
+                with logger.contextualize(_test_runner_log_writer=log_writer):
+                    ctx = TestContext(module_path, log_file, session)
+                    test(ctx)
+                return TestResult(TestStatus.PASSED, duration=perf_counter() - start)
+            except Exception as e:
+                return TestResult(TestStatus.FAILED, str(e), perf_counter() - start)
+            finally:
+                log_writer.close()
 
     def _setup_logger(self):
         if not getattr(logger, "_test_runner_is_setup", False):
@@ -105,8 +264,9 @@ class TestRunner:
                         ...
 
                     def logger_sink(message: "Message"):
-                        if file := message.record["extra"].get("_test_runner_log_file"):
-                            cast(Path, file).write_text(message, encoding="utf-8")
+                        extra = message.record["extra"]
+                        if writer := extra.get("_test_runner_log_writer"):
+                            cast(BufferedLogWriter, writer).write(message)
 
                     logger.add(logger_sink)
                     setattr(logger, "_test_runner_is_setup", True)
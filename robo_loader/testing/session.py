@@ -0,0 +1,277 @@
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager, suppress
+from dataclasses import dataclass, replace
+from multiprocessing import Event, Queue
+from multiprocessing.synchronize import Event as EventType
+from pathlib import Path
+from queue import Empty
+from typing import Any, Iterator, Literal
+
+from loguru import logger
+
+from robo_loader.impl.models import Command, Identifier
+from robo_loader.impl.module_loader import ModuleLoader
+from robo_loader.impl.module_process import InfoQueue, ModuleInfo
+from robo_loader.impl.simulation import Simulation, random_timeline
+from robo_loader.testing.limiter import AdaptiveLimiter
+from robo_loader.testing.test_model import Expectation, TestContext
+
+
+# (phase, info that starts it, info that ends it)
+_PHASES = [
+    ("startup", ModuleInfo.STARTING, ModuleInfo.INSTALLING_REQS),
+    ("install", ModuleInfo.INSTALLING_REQS, ModuleInfo.LOADING),
+    ("load", ModuleInfo.LOADING, ModuleInfo.RUNNING),
+]
+
+
+@dataclass(frozen=True)
+class Recorded:
+    kind: Literal["state_change", "message", "event"]
+    identifier: Identifier
+    value: Any
+    event_name: str | None = None
+    elapsed: float = 0.0
+
+
+class RandomValueFeederThread(threading.Thread):
+    LABELS = [
+        "Sıcaklık",
+        "Nem",
+        "Işık",
+        "Mesafe",
+        "Nabız",
+        "Hava Kalitesi",
+        "Gaz",
+        "Titreşim",
+        "Yağmur",
+        "Yakınlık",
+    ]
+
+    def __init__(self, cancel_event: EventType, values_queue: Queue):
+        super().__init__()
+        self.cancel_event = cancel_event
+        self.values_queue = values_queue
+
+    def run(self):
+        while not self.cancel_event.is_set():
+            values = {}
+            for label in RandomValueFeederThread.LABELS:
+                values[label] = random.randint(0, 500)
+            self.values_queue.put(values)
+            self.cancel_event.wait(10)
+
+
+class ModuleSession:
+    """Loads a module once and records everything it does, every behavioral
+    test checks its expectation against the same recording.
+
+    The module is loaded by the first test that needs it and stopped as soon
+    as every expectation is decided. With `simulate`, it runs on a virtual
+    clock so the deadlines are in virtual seconds and pass almost instantly,
+    commands are timed by when the module sent them on that clock.
+    """
+
+    def __init__(
+        self,
+        module_path: Path,
+        expectations: list[Expectation],
+        simulate: bool = True,
+        limiter: AdaptiveLimiter | None = None,
+    ) -> None:
+        self.module_path = module_path
+        self.expectations = expectations
+        self.limiter = limiter
+        self.simulation = None
+        if simulate:
+            duration = max((e.deadline for e in expectations), default=0)
+            self.simulation = Simulation(
+                duration,
+                random_timeline(duration, RandomValueFeederThread.LABELS),
+            )
+
+        self.recording: list[Recorded] = []
+        self.decisions: dict[Expectation, bool] = {}
+        self.error: BaseException | None = None
+
+        self._lock = threading.Lock()
+        self._started = False
+        self._finished = threading.Event()
+        self._cancel_event = Event()
+        self._start_time = 0.0
+        self._info_queue: InfoQueue = Queue()
+        self._info_times: dict[ModuleInfo, float] = {}
+        self._slot_lock = threading.Lock()
+        self._slot_users = 0
+        self._slot = ExitStack()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """The limiter's process slot, shared by the tests checking this
+        session: the first one in takes it, the last one out gives it back.
+        Enter it before the test's time starts."""
+        with self._slot_lock:
+            if self._slot_users == 0 and self.limiter is not None:
+                self._slot.enter_context(self.limiter.slot("process"))
+            self._slot_users += 1
+
+        try:
+            yield
+        finally:
+            with self._slot_lock:
+                self._slot_users -= 1
+                if self._slot_users == 0:
+                    self._slot.close()
+
+    def check(self, ctx: TestContext, expectation: Expectation) -> bool:
+        """Returns whether the module met `expectation`, loading it first if
+        no other test has done so."""
+        with self._lock:
+            should_load = not self._started
+            self._started = True
+
+        if should_load:
+            self._load(ctx)
+        else:
+            self._finished.wait()
+
+        # Decisions made before the module crashed still count
+        if expectation not in self.decisions:
+            assert (
+                False
+            ), "Modül yüklenirken hata oluştu. (log dosyalarını kontrol edin)"
+
+        return self.decisions[expectation]
+
+    def _record(self, recorded: Recorded):
+        with self._lock:
+            self.recording.append(recorded)
+            # Too late for the expectations whose deadline had passed
+            self._expire(recorded.elapsed)
+            for expectation in self.expectations:
+                if expectation in self.decisions:
+                    continue
+
+                if expectation.matches(recorded):
+                    logger.info(f"Expectation decided: {expectation.name}")
+                    self.decisions[expectation] = expectation.should_happen
+
+            self._cancel_if_decided()
+
+    def _expire(self, elapsed: float):
+        for expectation in self.expectations:
+            if expectation in self.decisions:
+                continue
+
+            if elapsed >= expectation.deadline:
+                if expectation.should_happen:
+                    logger.error(
+                        f"Module loaded but {expectation.name!r} timed out "
+                        f"after {expectation.deadline} seconds"
+                    )
+                self.decisions[expectation] = not expectation.should_happen
+
+    def _decide_expired(self):
+        # Wall-clock time says nothing about the virtual deadlines, those are
+        # decided by the recorded times and when the simulation ends
+        if self.simulation is not None:
+            return
+
+        elapsed = self._elapsed()
+        with self._lock:
+            self._expire(elapsed)
+            self._cancel_if_decided()
+
+    def _cancel_if_decided(self):
+        if len(self.decisions) == len(self.expectations):
+            self._cancel_event.set()
+
+    def _watch(self):
+        while not self._cancel_event.is_set():
+            self._receive_info(timeout=0.5)
+            self._decide_expired()
+
+    def _receive_info(self, timeout: float | None):
+        with suppress(Empty):
+            _, info, _ = self._info_queue.get(timeout=timeout)
+            self._info_times.setdefault(info, self._elapsed())
+
+    @property
+    def phase_timings(self) -> dict[str, float]:
+        """Seconds the module spent in each startup phase."""
+        rv = {}
+        for phase, start, end in _PHASES:
+            if start in self._info_times and end in self._info_times:
+                rv[phase] = self._info_times[end] - self._info_times[start]
+        return rv
+
+    def _load(self, ctx: TestContext):
+        def on_command(command: Command):
+            idf = Identifier(
+                title=command["title"],
+                author=command["author"],
+                module_name=command["module_name"],
+            )
+            virtual_time = command["virtual_time"]
+            elapsed = self._elapsed() if virtual_time is None else virtual_time
+
+            match command["verb"]:
+                case "Durum":
+                    recorded = Recorded("state_change", idf, command["value"])
+                case "Mesaj":
+                    recorded = Recorded("message", idf, command["value"])
+                case "event":
+                    event_name, value = command["value"]
+                    recorded = Recorded("event", idf, value, event_name)
+                case _:
+                    return
+            self._record(replace(recorded, elapsed=elapsed))
+
+        self._start_time = time.monotonic()
+        watcher_thread = threading.Thread(target=self._watch, daemon=True)
+        try:
+            watcher_thread.start()
+
+            values_queue = Queue()
+            if self.simulation is None:
+                feeder_thread = RandomValueFeederThread(
+                    self._cancel_event, values_queue
+                )
+                feeder_thread.start()
+
+            ModuleLoader(
+                module_paths=[self.module_path],
+                cancellation_event=self._cancel_event,
+                log_path=ctx.log_file,
+                values_queue=values_queue,
+                on_command=on_command,
+                simulation=self.simulation,
+                audio_backend="recording",
+                info_queue=self._info_queue,
+            ).load()
+        except BaseException as e:
+            logger.exception(
+                f"An error occurred while loading the module: {self.module_path.name}"
+            )
+            self.error = e
+        finally:
+            self._cancel_event.set()
+            watcher_thread.join()
+            while not self._info_queue.empty():
+                self._receive_info(timeout=0.1)
+            if self.error is None:
+                self._decide_remaining()
+            self._finished.set()
+
+        if isinstance(self.error, KeyboardInterrupt):
+            raise self.error
+
+    def _decide_remaining(self):
+        with self._lock:
+            for expectation in self.expectations:
+                self.decisions.setdefault(expectation, not expectation.should_happen)
+
+    def _elapsed(self) -> float:
+        return time.monotonic() - self._start_time
@@ -1,12 +1,36 @@
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Protocol, cast
+from typing import TYPE_CHECKING, Any, Callable, Literal, Protocol, cast, get_args
+
+if TYPE_CHECKING:
+    from robo_loader.testing.session import ModuleSession, Recorded
+
+# What a test's outcome depends on, used as the test result cache key.
+TestInput = Literal["tree", "requirements"]
+
+# What a test mostly spends its time on, used to decide how many can run at once.
+TestResource = Literal["io", "cpu", "process"]
 
 
 @dataclass(frozen=True)
 class TestContext:
     module_path: Path
     log_file: Path
+    session: "ModuleSession"
+
+
+@dataclass(frozen=True, eq=False)
+class Expectation:
+    """Something a loaded module should (or shouldn't) do.
+
+    It is decided as soon as a matching command is recorded, or when
+    `deadline` seconds pass without one.
+    """
+
+    name: str
+    matches: "Callable[[Recorded], bool]"
+    should_happen: bool = True
+    deadline: float = 120
 
 
 class _TestFunction(Protocol):
@@ -21,6 +45,14 @@ class TestMeta:
     name: str
     description: str = field(repr=False)
     dependencies: frozenset["Test"]
+    inputs: frozenset[TestInput]
+    # Seconds before the test and every process it started are killed,
+    # `None` uses the runner's default.
+    timeout: float | None = None
+    resource: TestResource = "io"
+    # Checks expectations on the module session, which takes the limiter slot
+    # once for all of them instead of every such test taking its own.
+    uses_session: bool = False
 
 
 class Test(_TestFunction):
@@ -29,17 +61,35 @@ class Test(_TestFunction):
 
 class Tests:
     tests: list[Test]
+    expectations: list[Expectation]
+    version: int
 
-    def __init__(self) -> None:
+    def __init__(self, version: int = 0) -> None:
+        """`version` must be bumped whenever the tests change in a way that
+        invalidates previously cached results."""
         self.tests = []
-
-    def __call__(self, *, depends: list[Test] | None = None) -> Any:
+        self.expectations = []
+        self.version = version
+
+    def __call__(
+        self,
+        *,
+        depends: list[Test] | None = None,
+        inputs: list[TestInput] | None = None,
+        timeout: float | None = None,
+        resource: TestResource = "io",
+        uses_session: bool = False,
+    ) -> Any:
         def wrapper(test: _TestFunction) -> Test:
             test = cast(Test, test)
             test.test_meta = TestMeta(
                 name=test.__name__,
                 description=test.__doc__ or "?",
                 dependencies=frozenset(depends or []),
+                inputs=frozenset(inputs or get_args(TestInput)),
+                timeout=timeout,
+                resource=resource,
+                uses_session=uses_session,
             )
 
             self.tests.append(test)
@@ -47,6 +97,19 @@ class Tests:
 
         return wrapper
 
+    def expect(
+        self,
+        name: str,
+        matches: "Callable[[Recorded], bool]",
+        should_happen: bool = True,
+        deadline: float = 120,
+    ) -> Expectation:
+        """Registers an expectation that is checked on the shared module
+        session, see `ModuleSession`."""
+        expectation = Expectation(name, matches, should_happen, deadline)
+        self.expectations.append(expectation)
+        return expectation
+
     def get_test(self, test_meta: TestMeta) -> Test:
         for test in self.tests:
             if test.test_meta == test_meta:
@@ -1,16 +1,9 @@
-import multiprocessing
-import random
-import threading
-from multiprocessing import Event, Queue
-from multiprocessing.synchronize import Event as EventType
-
 from loguru import logger
 
-from robo_loader.impl.module_loader import ModuleLoader
 from robo_loader.impl.venv_manager import RequirementsError, VenvManager
 from robo_loader.testing.test_model import TestContext, Tests
 
-tests = Tests()
+tests = Tests(version=3)
 
 
 @tests()
@@ -45,7 +38,7 @@ def test_has_main_py(ctx: TestContext):
     assert main_py_path.exists(), "main.py dosyası bulunamadı."
 
 
-@tests(depends=[test_has_main_py])
+@tests(depends=[test_has_main_py], resource="cpu")
 def test_main_py_has_main_fn(ctx: TestContext):
     """main.py dosyasında main fonksiyonu olmalı | async def main(core: Core):"""
     import ast
@@ -76,7 +69,7 @@ def test_main_py_has_main_fn(ctx: TestContext):
         assert False, "main.py dosyasında main fonksiyonu bulunamadı."
 
 
-@tests()
+@tests(inputs=["requirements"], timeout=900, resource="process")
 def test_requirements_installable(ctx: TestContext):
     """requirements.txt dosyasındaki paketler yüklenebilmeli"""
     venv_manager = VenvManager(ctx.module_path.name)
@@ -87,25 +80,35 @@ def test_requirements_installable(ctx: TestContext):
         assert False, "requirements.txt hatalı."
 
 
+state_changed = tests.expect(
+    "state_change",
+    lambda r: r.kind == "state_change",
+)
+message_sent = tests.expect(
+    "send_message",
+    lambda r: r.kind == "message",
+    should_happen=False,
+    deadline=30,
+)
+sound_played = tests.expect(
+    "play_sound",
+    lambda r: r.kind == "event" and r.event_name == "play_sound",
+)
+
+
 @tests(
     depends=[
         test_main_py_has_main_fn,
         test_requirements_installable,
-    ]
+    ],
+    timeout=180,
+    resource="process",
+    uses_session=True,
 )
 def test_load_and_state_change(ctx: TestContext):
     """Modül yüklenebilmeli ve durum belirtmeli"""
-    cancel_event = Event()
-    state_changed = False
-
-    def handle_state_change(*_, **__):
-        nonlocal state_changed
-        state_changed = True
-        cancel_event.set()
-
-    load_module(ctx, cancel_event, dict(on_state_change=handle_state_change))
-    assert (
-        state_changed
+    assert ctx.session.check(
+        ctx, state_changed
     ), "Modül durum belirmedi/değiştirmedi. [core.set_state() çağrılmadı]"
 
 
@@ -113,107 +116,27 @@ def test_load_and_state_change(ctx: TestContext):
     depends=[
         test_main_py_has_main_fn,
         test_requirements_installable,
-    ]
+    ],
+    timeout=180,
+    resource="process",
+    uses_session=True,
 )
 def test_send_message_not_called(ctx: TestContext):
     """Mesajlar artık görünmeyecek"""
-    cancel_event = Event()
-    message_sent = False
-
-    def handle_message(*_, **__):
-        nonlocal message_sent
-        message_sent = True
-        cancel_event.set()
-
-    load_module(ctx, cancel_event, dict(on_message=handle_message), 30)
-    assert (
-        not message_sent
+    assert ctx.session.check(
+        ctx, message_sent
     ), "Mesajlar artık görünmeyecek bunun yerine core.set_state() kullanın."
 
 
-@tests(depends=[test_load_and_state_change])
+@tests(
+    depends=[test_load_and_state_change],
+    timeout=180,
+    resource="process",
+    uses_session=True,
+)
 def test_play_sound_called(ctx: TestContext):
     """Modül ses çalmalı"""
     logger.info("Testing if the module plays a sound")
-    cancel_event = Event()
-    sound_played = False
-
-    def handle_event(_, event_name, _v):
-        nonlocal sound_played
-        if event_name == "play_sound":
-            logger.info("Sound played")
-            sound_played = True
-            cancel_event.set()
-
-    load_module(ctx, cancel_event, dict(on_event=handle_event))
-    assert sound_played, "Modül ses çalmadı. [core.play_sound() çağrılmadı]"
-
-
-class RandomValueFeederThread(threading.Thread):
-    LABELS = [
-        "Sıcaklık",
-        "Nem",
-        "Işık",
-        "Mesafe",
-        "Nabız",
-        "Hava Kalitesi",
-        "Gaz",
-        "Titreşim",
-        "Yağmur",
-        "Yakınlık",
-    ]
-
-    def __init__(self, cancel_event: EventType, values_queue: Queue):
-        super().__init__()
-        self.cancel_event = cancel_event
-        self.values_queue = values_queue
-
-    def run(self):
-        import time
-
-        while not self.cancel_event.is_set():
-            values = {}
-            for label in RandomValueFeederThread.LABELS:
-                values[label] = random.randint(0, 500)
-            self.values_queue.put(values)
-            time.sleep(10)
-
-
-def load_module(
-    ctx: TestContext,
-    cancel_event: EventType,
-    loader_kwargs: dict,
-    timeout_seconds: int = 120,
-):
-    try:
-
-        def handle_timeout():
-            if cancel_event.is_set():
-                return
-
-            logger.error("Module loaded but expectation timed out after 2 minutes")
-            cancel_event.set()
-
-        timeout_thread = threading.Timer(timeout_seconds, handle_timeout)
-        timeout_thread.start()
-
-        values_queue = Queue()
-        feeder_thread = RandomValueFeederThread(cancel_event, values_queue)
-        feeder_thread.start()
-
-        ModuleLoader(
-            module_paths=[ctx.module_path],
-            cancellation_event=cancel_event,
-            log_path=ctx.log_file,
-            values_queue=values_queue,
-            **loader_kwargs,
-        ).load()
-        timeout_thread.cancel()
-    except (KeyboardInterrupt, AssertionError):
-        cancel_event.set()
-        raise
-    except BaseException:
-        logger.exception(
-            f"An error occurred while loading the module: {ctx.module_path.name}"
-        )
-        assert False, "Modül yüklenirken hata oluştu. (log dosyalarını kontrol edin)"
+    assert ctx.session.check(
+        ctx, sound_played
+    ), "Modül ses çalmadı. [core.play_sound() çağrılmadı]"
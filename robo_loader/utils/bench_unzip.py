@@ -0,0 +1,90 @@
+import argparse
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import rich
+import rich.table
+
+from robo_loader import ROOT_PATH
+from robo_loader.utils import unzip
+from robo_loader.utils.bytecode import compile_tree
+
+
+def _bench(archives: list[Path], workers: int, in_process: bool) -> tuple[float, int]:
+    unzip.staging_path.mkdir(exist_ok=True)
+    # Inside the staging directory so the final renames stay on one device
+    with tempfile.TemporaryDirectory(dir=unzip.staging_path) as target:
+        if in_process:
+            start = perf_counter()
+            extracted = unzip.extract_all(archives, Path(target), workers)
+            elapsed = perf_counter() - start
+        else:
+            start = perf_counter()
+            extracted = []
+            for archive in archives:
+                try:
+                    # extract_archive compiles too, so the times compare
+                    unzip.unzip_with_7z(archive, Path(target) / archive.stem)
+                    compile_tree(Path(target) / archive.stem, workers=1)
+                    extracted.append(archive)
+                except Exception as e:
+                    rich.print(f"[red]{archive.name}: {e}")
+            elapsed = perf_counter() - start
+
+    return elapsed, len(extracted)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures extracting and byte-compiling every archive in "
+        "the gdrive directory"
+    )
+    parser.add_argument(
+        "archives_path", nargs="?", type=Path, default=ROOT_PATH / "gdrive"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 4, os.cpu_count() or 1}),
+    )
+    parser.add_argument(
+        "--no-7z", action="store_true", help="Skip the sequential 7z baseline"
+    )
+    args = parser.parse_args()
+
+    if unzip.py7zr is None:
+        rich.print("[yellow]py7zr isn't installed, .7z archives use the 7z binary")
+
+    archives = sorted(p for p in args.archives_path.iterdir() if p.is_file())
+    total_mb = sum(p.stat().st_size for p in archives) / 1024 / 1024
+
+    table = rich.table.Table(
+        title=f"{len(archives)} archives, {total_mb:.1f} MiB compressed"
+    )
+    table.add_column("Method")
+    table.add_column("Extracted", justify="right")
+    table.add_column("Time", justify="right")
+    table.add_column("MiB/s", justify="right")
+
+    runs = [(f"in-process, {n} workers", n, True) for n in args.workers]
+    if not args.no_7z and shutil.which(unzip.seven_zip_path()):
+        runs.insert(0, ("7z binary, sequential", 1, False))
+
+    for name, workers, in_process in runs:
+        elapsed, extracted = _bench(archives, workers, in_process)
+        table.add_row(
+            name,
+            f"{extracted}/{len(archives)}",
+            f"{elapsed:.2f}s",
+            f"{total_mb / elapsed:.1f}",
+        )
+
+    rich.print(table)
+
+
+if __name__ == "__main__":
+    main()
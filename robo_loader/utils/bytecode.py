@@ -0,0 +1,29 @@
+import compileall
+import py_compile
+import re
+from pathlib import Path
+
+from loguru import logger
+
+# Directories that are never imported by a module, no need to compile them.
+_SKIP_DIRS = re.compile(r"[\\/](\.git|__MACOSX|venv|\.venv|site-packages)[\\/]")
+
+
+def compile_tree(path: Path, workers: int = 0) -> bool:
+    """Compiles every `.py` file under `path` into `__pycache__` using
+    `workers` processes (0 means one per CPU).
+
+    Hash based pycs are used because module trees are re-extracted from
+    archives, so their mtimes can't be trusted to invalidate the cache.
+    """
+    logger.info(f"Compiling bytecode for {path}")
+    success = compileall.compile_dir(
+        path,
+        quiet=2,
+        workers=workers,
+        rx=_SKIP_DIRS,
+        invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+    )
+    if not success:
+        logger.warning(f"Some files could not be compiled in {path}")
+    return bool(success)
@@ -1,7 +1,16 @@
 import os
 from pathlib import Path
+import queue
 import shutil
+import threading
 from typing import Callable
+from uuid import uuid4
+
+from loguru import logger
+
+from robo_loader import ROOT_PATH
+
+trash_path = ROOT_PATH / ".trash"
 
 
 def rmrf(path: Path):
@@ -38,3 +47,101 @@ def rmrf(path: Path):
 
     for p in reversed(to_delete):
         safe_rm(p.rmdir)
+
+
+class _TrashDeleter:
+    """Deletes what is moved into the trash with a few daemon threads.
+
+    Whatever is left when the process exits is swept when the next one
+    starts deleting. Other processes may sweep at the same time, so
+    leftovers are claimed by renaming them first.
+    """
+
+    def __init__(self, workers: int = 4) -> None:
+        self._queue: "queue.Queue[Path]" = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+
+        trash_path.mkdir(exist_ok=True)
+        for leftover in trash_path.iterdir():
+            claimed = trash_path / uuid4().hex
+            try:
+                leftover.rename(claimed)
+            except OSError:
+                continue
+            self.submit(claimed)
+
+        for i in range(workers):
+            threading.Thread(
+                target=self._run, name=f"TrashDeleter-{i}", daemon=True
+            ).start()
+
+    def submit(self, path: Path) -> None:
+        with self._idle:
+            self._pending += 1
+        self._queue.put(path)
+
+    def wait(self) -> None:
+        with self._idle:
+            self._idle.wait_for(lambda: self._pending == 0)
+
+    def _run(self) -> None:
+        while True:
+            path = self._queue.get()
+            try:
+                rmrf(path)
+            except FileNotFoundError:
+                # Claimed by another process's sweep
+                pass
+            except OSError:
+                logger.exception(f"Could not delete {path}, will retry next run")
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+
+
+_deleter: _TrashDeleter | None = None
+_deleter_lock = threading.Lock()
+
+
+def _get_deleter() -> _TrashDeleter:
+    global _deleter
+    with _deleter_lock:
+        if _deleter is None:
+            _deleter = _TrashDeleter()
+        return _deleter
+
+
+def move_to_trash(path: Path) -> None:
+    """Renames `path` into the trash to be deleted in the background. Raises
+    `OSError` and leaves `path` as it is if it can't be renamed, e.g. when a
+    file in it is open on Windows."""
+    if not path.exists() and not path.is_symlink():
+        return
+
+    # Started first so its sweep doesn't pick up what is renamed below
+    deleter = _get_deleter()
+    destination = trash_path / f"{path.name}-{uuid4().hex}"
+    path.rename(destination)
+    deleter.submit(destination)
+
+
+def trash(path: Path) -> None:
+    """Like `rmrf`, but `path` is only renamed into the trash and deleted in
+    the background. Falls back to `rmrf` if it can't be renamed there, e.g.
+    when it is on another filesystem.
+
+    Only for scratch directories, use `move_to_trash` for anything that must
+    stay whole if it can't be moved."""
+    try:
+        move_to_trash(path)
+    except OSError:
+        rmrf(path)
+
+
+def wait_for_trash() -> None:
+    """Blocks until everything trashed so far is deleted, for scripts that
+    are about to exit."""
+    if _deleter is not None:
+        _deleter.wait()
@@ -1,90 +1,222 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
 import rich
-from rich.progress import track
+from rich.progress import Progress, track
 from robo_loader import ROOT_PATH
-import hashlib
-
-
-def calculate_md5(path: Path):
-    """Calculate MD5 hash of a file."""
-    hash_md5 = hashlib.md5()
-    with path.open("rb") as f:
-        # Read file in chunks to avoid memory issues with large files
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-
-def main():
-    destination = ROOT_PATH / "gdrive"
-    destination.mkdir(exist_ok=True)
-
-    # for file in track(list(destination.iterdir()), description="Deleting old files"):
-    #     file.unlink()
-
-    folder_id = (
-        "1iicnd54klaLTvISbZe_LLOT2vNOOO6trqh-GCwgn8BX6wH3edbURcNAfaB73Aj3V1HlLt1x6"
-    )
-
-    # Authenticate and create the PyDrive client
-    gauth = GoogleAuth()
-    gauth.LoadCredentialsFile("creds")
-    # gauth.LocalWebserverAuth()  # Creates local webserver and automatically handles authentication
-    # gauth.SaveCredentialsFile("creds")
-    drive = GoogleDrive(gauth)
-
-    gdrive_file_iter = drive.ListFile(
-        {"q": f"'{folder_id}' in parents and trashed=false"}
-    ).GetList()
-    gdrive_file_list = list(gdrive_file_iter)
-
-    user_files = {}
-    for file in track(gdrive_file_list, "[green]Comparing files..."):
-        username = file["lastModifyingUserName"]
-        if username not in user_files:
-            user_files[username] = file
-        else:
-            existing_file_mod_date = datetime.fromisoformat(
-                user_files[username]["modifiedDate"]
-            )
-            current_file_mod_date = datetime.fromisoformat(file["modifiedDate"])
-            if current_file_mod_date > existing_file_mod_date:
-                user_files[username] = file
-
-    files = list(user_files.values())
-    downloaded_files: list[str] = list()
-
-    for file in track(files, "[green]Downloading files..."):
-        file_name = file["title"]
-        local_path = destination / file_name
-        if local_path.exists():
-            remote_md5 = file["md5Checksum"]
-            local_md5 = calculate_md5(local_path)
-            if remote_md5 == local_md5:
-                continue
-            else:
-                local_path.unlink()
-
-        file.GetContentFile(str(local_path))
-        downloaded_files.append(file_name)
+from robo_loader.utils.manifest import FileHashes, FileManifest, Hasher
+from robo_loader.utils.storage import (
+    PyDriveBackend,
+    RangeIgnoredError,
+    RemoteFile,
+    StorageBackend,
+)
+
+destination_path = ROOT_PATH / "gdrive"
+partial_path = ROOT_PATH / "gdrive_partial"
+state_path = ROOT_PATH / ".gdrive_state.json"
+
+folder_id = "1iicnd54klaLTvISbZe_LLOT2vNOOO6trqh-GCwgn8BX6wH3edbURcNAfaB73Aj3V1HlLt1x6"
+
+
+@dataclass
+class SyncState:
+    """The last listing of the folder and the change token it is valid at."""
+
+    token: str | None = None
+    files: dict[str, RemoteFile] = field(default_factory=dict)
+
+    @staticmethod
+    def load(path: Path) -> "SyncState":
+        if not path.exists():
+            return SyncState()
+
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return SyncState(
+            data["token"],
+            {id: RemoteFile.from_json(file) for id, file in data["files"].items()},
+        )
+
+    def save(self, path: Path) -> None:
+        data = {
+            "token": self.token,
+            "files": {id: file.to_json() for id, file in self.files.items()},
+        }
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+def latest_per_user(files: list[RemoteFile]) -> list[RemoteFile]:
+    user_files: dict[str, RemoteFile] = {}
+    for file in files:
+        existing = user_files.get(file.owner)
+        if existing is None or datetime.fromisoformat(
+            file.modified
+        ) > datetime.fromisoformat(existing.modified):
+            user_files[file.owner] = file
+    return list(user_files.values())
+
+
+def download(
+    backend: StorageBackend,
+    file: RemoteFile,
+    local_path: Path,
+    manifest: FileManifest,
+    progress: Progress | None = None,
+    task=None,
+) -> None:
+    """Downloads `file` into `partial_path` first, continuing from where an
+    earlier attempt stopped, and moves it to `local_path` once it is
+    complete."""
+    part = partial_path / f"{file.id.replace('/', '_')}.part"
+    offset = part.stat().st_size if part.exists() else 0
+    if offset > file.size:
+        offset = 0
+    if progress is not None:
+        progress.advance(task, offset)
+
+    def start_over() -> FileHashes:
+        if progress is not None:
+            progress.advance(task, -part.stat().st_size)
+        return _fetch(backend, file, part, 0, progress, task)
+
+    try:
+        hashes = _fetch(backend, file, part, offset, progress, task)
+    except RangeIgnoredError:
+        hashes = start_over()
+    else:
+        if offset and file.md5 and hashes.md5 != file.md5:
+            # The earlier part was probably from another version
+            hashes = start_over()
+
+    if file.md5 and hashes.md5 != file.md5:
+        part.unlink()
+        raise IOError(f"MD5 mismatch for {file.title!r}")
+
+    os.replace(part, local_path)
+    manifest.record(local_path, hashes)
+
+
+def _fetch(
+    backend: StorageBackend,
+    file: RemoteFile,
+    part: Path,
+    offset: int,
+    progress: Progress | None,
+    task,
+) -> FileHashes:
+    """Appends `file` from `offset` on to the first `offset` bytes of `part`,
+    which is emptied if that's 0, and returns the hashes of the whole part."""
+    hasher = Hasher()
+    if offset:
+        hasher.update_from(part)
+    with part.open("ab" if offset else "wb") as f:
+        for chunk in backend.iter_chunks(file, offset):
+            f.write(chunk)
+            hasher.update(chunk)
+            if progress is not None:
+                progress.advance(task, len(chunk))
+    return hasher.result()
+
+
+def refresh_listing(backend: StorageBackend) -> list[RemoteFile]:
+    """Updates the saved listing with the backend's changes and returns the
+    latest file of every user."""
+    destination_path.mkdir(exist_ok=True)
+    partial_path.mkdir(exist_ok=True)
+
+    state = SyncState.load(state_path)
+    changes = backend.list_changes(state.token)
+    if changes.complete:
+        state.files = {}
+    for file_id in changes.removed:
+        state.files.pop(file_id, None)
+    for file in changes.changed:
+        state.files[file.id] = file
+    state.token = changes.token
+    state.save(state_path)
+
+    return latest_per_user(list(state.files.values()))
+
+
+def is_up_to_date(file: RemoteFile, manifest: FileManifest) -> bool:
+    local_path = destination_path / file.title
+    return local_path.exists() and manifest.md5(local_path) == file.md5
+
+
+def remove_stale(files: list[RemoteFile], manifest: FileManifest) -> None:
+    """Deletes the local files that aren't in `files` anymore."""
+    gdrive_filenames = {file.title for file in files}
+    for path in destination_path.iterdir():
+        if path.name not in gdrive_filenames:
+            path.unlink()
+            manifest.forget(path)
+            rich.print(f"[red]Deleted {path.name!r}")
+
+
+def sync(
+    backend: StorageBackend, manifest: FileManifest, max_workers: int = 4
+) -> list[str]:
+    """Brings `destination_path` up to date with the backend and returns the
+    names of the downloaded files."""
+    files = refresh_listing(backend)
+    to_download = [
+        file
+        for file in track(files, "[green]Comparing files...")
+        if not is_up_to_date(file, manifest)
+    ]
+
+    downloaded_files: list[str] = []
+    with (
+        Progress() as progress,
+        ThreadPoolExecutor(max_workers, thread_name_prefix="gdrive_dl") as executor,
+    ):
+        task = progress.add_task(
+            "[green]Downloading files...", total=sum(f.size for f in to_download)
+        )
+        futures = {
+            executor.submit(
+                download,
+                backend,
+                file,
+                destination_path / file.title,
+                manifest,
+                progress,
+                task,
+            ): file
+            for file in to_download
+        }
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                future.result()
+                downloaded_files.append(file.title)
+            except Exception as e:
+                rich.print(f"[red]Failed to download {file.title!r}: {e}")
+
+    remove_stale(files, manifest)
+    return downloaded_files
+
+
+def main(backend: StorageBackend | None = None):
+    if backend is None:
+        backend = PyDriveBackend(folder_id)
+
+    manifest = FileManifest()
+    try:
+        downloaded_files = sync(backend, manifest)
+    finally:
+        manifest.close()
 
     if downloaded_files:
         rich.print(f"[green]Downloaded: {downloaded_files!r}")
     else:
         rich.print(f"[yellow]No new files to download")
 
-    gdrive_filenames = [file["title"] for file in files]
-    for file in track(
-        list(destination.iterdir()),
-        "[green]Deleting old files...",
-    ):
-        if file.name not in gdrive_filenames:
-            file.unlink()
-            rich.print(f"[red]Deleted {file.name!r}")
-
 
 if __name__ == "__main__":
     main()
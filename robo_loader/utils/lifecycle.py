@@ -1,17 +1,106 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 import rich
+import rich.live
 import rich.rule
-from robo_loader.utils.gdrive_dl import main as gdrive_dl
-from robo_loader.utils.unzip import main as unzip
-from robo_loader.utils.test_all import main as test_all
+from robo_loader import ROOT_PATH
+from robo_loader.testing.history import PhaseTimings
+from robo_loader.utils import gdrive_dl, unzip
+from robo_loader.utils.fs import wait_for_trash
+from robo_loader.utils.manifest import FileManifest
+from robo_loader.utils.pipeline import Pipeline, Stage
+from robo_loader.utils.storage import PyDriveBackend, RemoteFile
+from robo_loader.utils.test_all import (
+    ModuleTester,
+    Results,
+    package_to_share,
+    report_history,
+    report_results,
+    report_timings,
+)
 
 
 def main():
-    rich.print(rich.rule.Rule("GDRIVE DOWNLOAD"))
-    gdrive_dl()
-    rich.print(rich.rule.Rule("UNZIP"))
-    unzip()
-    rich.print(rich.rule.Rule("TEST ALL"))
-    test_all()
+    """Downloads, extracts and tests every archive, each one moving on to the
+    next step as soon as it is ready instead of waiting for the others."""
+    target_dir = ROOT_PATH / "modules"
+    target_dir.mkdir(exist_ok=True)
+
+    backend = PyDriveBackend(gdrive_dl.folder_id)
+    manifest = FileManifest()
+    try:
+        run(backend, manifest, target_dir)
+    finally:
+        manifest.close()
+
+    wait_for_trash()
+
+
+def run(backend: PyDriveBackend, manifest: FileManifest, target_dir: Path):
+    rich.print(rich.rule.Rule("GDRIVE LISTING"))
+    files = gdrive_dl.refresh_listing(backend)
+    rich.print(f"{len(files)} files")
+
+    staged_modules_path = unzip.prepare_staging()
+    extract_workers = os.cpu_count() or 4
+    extract_pool = ProcessPoolExecutor(extract_workers)
+    # One connection for every stage, the tester mustn't open its own
+    tester = ModuleTester(manifest=manifest)
+    results: Results = {}
+    phase_timings: PhaseTimings = {}
+
+    def download(file: RemoteFile) -> Path:
+        local_path = gdrive_dl.destination_path / file.title
+        if not gdrive_dl.is_up_to_date(file, manifest):
+            gdrive_dl.download(backend, file, local_path, manifest)
+        return local_path
+
+    def extract(archive: Path) -> Path | None:
+        if unzip.changed_archives([archive], target_dir, manifest):
+            extract_pool.submit(
+                unzip.extract_archive, archive, staged_modules_path / archive.stem
+            ).result()
+            if not unzip.install(archive, staged_modules_path, target_dir, manifest):
+                return None
+        return target_dir / archive.stem
+
+    def test(module_path: Path) -> Path:
+        module_path, test_results, timings = tester(module_path)
+        results[module_path] = test_results
+        phase_timings[module_path] = timings
+        return module_path
+
+    # The limiter decides how many tests actually run at once
+    pipeline = Pipeline(
+        [
+            Stage("İndirme", download, workers=4),
+            Stage("Açma", extract, workers=extract_workers),
+            Stage("Test", test, workers=32),
+        ]
+    )
+
+    rich.print(rich.rule.Rule("PIPELINE"))
+    try:
+        with rich.live.Live(get_renderable=pipeline.render, refresh_per_second=2):
+            pipeline.run(files)
+
+        gdrive_dl.remove_stale(files, manifest)
+        unzip.retire_removed(
+            {Path(file.title).stem for file in files}, target_dir, manifest
+        )
+    finally:
+        extract_pool.shutdown()
+        tester.close()
+
+    rich.print(rich.rule.Rule("REPORT"))
+    report_results(results)
+    report_timings(results)
+    # Downloads and extraction are included, not comparable to test_all's wall time
+    report_history(results, phase_timings, None)
+    package_to_share()
+
 
 if __name__ == "__main__":
     main()
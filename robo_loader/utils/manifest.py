@@ -0,0 +1,167 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from robo_loader import ROOT_PATH
+
+manifest_path = ROOT_PATH / ".file_manifest.sqlite"
+
+
+@dataclass(frozen=True)
+class FileHashes:
+    md5: str
+    fast: str  # blake2b, for our own comparisons
+
+
+@dataclass(frozen=True)
+class Origin:
+    archive: str
+    archive_hash: str
+
+
+class Hasher:
+    """Computes `FileHashes` from chunks, for data that is read anyway."""
+
+    def __init__(self) -> None:
+        self._md5 = hashlib.md5()
+        self._fast = hashlib.blake2b(digest_size=20)
+
+    def update(self, chunk: bytes) -> None:
+        self._md5.update(chunk)
+        self._fast.update(chunk)
+
+    def update_from(self, path: Path) -> None:
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                self.update(chunk)
+
+    def result(self) -> FileHashes:
+        return FileHashes(self._md5.hexdigest(), self._fast.hexdigest())
+
+
+def _hash_file(path: Path) -> FileHashes:
+    hasher = Hasher()
+    hasher.update_from(path)
+    return hasher.result()
+
+
+class FileManifest:
+    """Remembers the hashes of files so they are only read again after their
+    size, mtime or inode changes.
+
+    Also records which archive each module was extracted from. Shared by the
+    download, unzip and test stages. Every write is committed right away, so
+    other connections (local test workers) see it and are never locked out.
+    """
+
+    def __init__(self, db_path: Path = manifest_path) -> None:
+        self._lock = threading.Lock()
+        # Other processes (local test workers) may use the same file. Each
+        # statement is its own transaction, WAL lets readers go on meanwhile.
+        self.connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    md5 TEXT NOT NULL,
+                    fast TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS origins (
+                    module TEXT PRIMARY KEY,
+                    archive TEXT NOT NULL,
+                    archive_hash TEXT NOT NULL
+                );
+                """
+            )
+
+    def hashes(self, path: Path) -> FileHashes:
+        key = str(path.absolute())
+        stat = path.stat()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, inode, md5, fast FROM files WHERE path = ?",
+                (key,),
+            ).fetchone()
+        if row is not None and tuple(row[:3]) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ):
+            return FileHashes(row[3], row[4])
+
+        hashes = _hash_file(path)
+        self._store(key, stat, hashes)
+        return hashes
+
+    def record(self, path: Path, hashes: FileHashes) -> None:
+        """Stores hashes computed while `path` was written."""
+        self._store(str(path.absolute()), path.stat(), hashes)
+
+    def _store(self, key: str, stat: os.stat_result, hashes: FileHashes) -> None:
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                    hashes.md5,
+                    hashes.fast,
+                ),
+            )
+
+    def md5(self, path: Path) -> str:
+        return self.hashes(path).md5
+
+    def fast_hash(self, path: Path) -> str:
+        return self.hashes(path).fast
+
+    def forget(self, path: Path) -> None:
+        """Drops `path` and everything under it."""
+        key = str(path.absolute())
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM files WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (key, _like_prefix(key + os.sep)),
+            )
+
+    def origin(self, module: str) -> Origin | None:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT archive, archive_hash FROM origins WHERE module = ?",
+                (module,),
+            ).fetchone()
+        return Origin(*row) if row is not None else None
+
+    def set_origin(self, module: str, archive: Path) -> None:
+        archive_hash = self.fast_hash(archive)
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO origins VALUES (?, ?, ?)",
+                (module, archive.name, archive_hash),
+            )
+
+    def remove_origin(self, module: str) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM origins WHERE module = ?", (module,))
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def _like_prefix(prefix: str) -> str:
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
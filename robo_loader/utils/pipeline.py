@@ -0,0 +1,143 @@
+import queue
+import threading
+from time import perf_counter
+from typing import Any, Callable, Iterable
+
+import rich.table
+from loguru import logger
+
+_DONE = object()
+
+
+class Stage:
+    """A step of a `Pipeline`, `workers` threads calling `fn` on the items of
+    a bounded input queue.
+
+    `fn` returns the item for the next stage, or `None` to drop it. Putting
+    into a full queue blocks, so a slow stage holds back the ones before it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[Any], Any],
+        workers: int = 1,
+        max_pending: int = 8,
+    ) -> None:
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.input: "queue.Queue[Any]" = queue.Queue(max_pending)
+        self.next: Stage | None = None
+
+        self.done = 0
+        self.failed = 0
+        self.active = 0
+        self.blocked_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        self.started_at = perf_counter()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        threading.Thread(
+            target=self._finish, name=f"{self.name}-finish", daemon=True
+        ).start()
+
+    def _run(self) -> None:
+        while (item := self.input.get()) is not _DONE:
+            with self._lock:
+                self.active += 1
+            start = perf_counter()
+            try:
+                result = self.fn(item)
+            except Exception:
+                logger.exception(f"{self.name} failed for {item!r}")
+                result = None
+                with self._lock:
+                    self.failed += 1
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.busy_seconds += perf_counter() - start
+
+            if result is not None:
+                with self._lock:
+                    self.done += 1
+                if self.next is not None:
+                    start = perf_counter()
+                    self.next.input.put(result)
+                    with self._lock:
+                        self.blocked_seconds += perf_counter() - start
+
+        # Let the other workers see the end too
+        self.input.put(_DONE)
+
+    def _finish(self) -> None:
+        for thread in self._threads:
+            thread.join()
+        self.finished_at = perf_counter()
+        self.finished.set()
+        if self.next is not None:
+            self.next.input.put(_DONE)
+
+    def throughput(self) -> float:
+        """Items per minute since the stage started."""
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or perf_counter()) - self.started_at
+        return self.done / elapsed * 60 if elapsed > 0 else 0.0
+
+
+class Pipeline:
+    """Stages connected by bounded queues, items flow through all of them
+    as soon as each stage is done with them."""
+
+    def __init__(self, stages: list[Stage]) -> None:
+        self.stages = stages
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next = next_stage
+
+    def run(self, items: Iterable[Any]) -> None:
+        """Feeds `items` into the first stage and waits for the last one."""
+        for stage in self.stages:
+            stage.start()
+
+        first = self.stages[0]
+        for item in items:
+            first.input.put(item)
+        first.input.put(_DONE)
+
+        for stage in self.stages:
+            stage.finished.wait()
+
+    def render(self) -> rich.table.Table:
+        table = rich.table.Table(title="Akış")
+        table.add_column("Aşama")
+        table.add_column("Biten", justify="right")
+        table.add_column("Hatalı", justify="right")
+        table.add_column("Sırada", justify="right")
+        table.add_column("Çalışan", justify="right")
+        table.add_column("Adet/dk", justify="right")
+        table.add_column("Bekleme (sn)", justify="right")
+        for stage in self.stages:
+            table.add_row(
+                stage.name,
+                str(stage.done),
+                str(stage.failed),
+                str(stage.input.qsize()),
+                f"{stage.active}/{stage.workers}",
+                f"{stage.throughput():.1f}",
+                f"{stage.blocked_seconds:.1f}",
+            )
+        return table
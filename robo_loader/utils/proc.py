@@ -0,0 +1,91 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+from collections import defaultdict
+from contextlib import suppress
+from contextvars import ContextVar
+from pathlib import Path
+
+
+def _descendants(pid: int) -> list[int]:
+    children: dict[int, list[int]] = defaultdict(list)
+    for stat_file in Path("/proc").glob("[0-9]*/stat"):
+        with suppress(OSError, ValueError, IndexError):
+            # The process name can contain spaces, the fields start after ")"
+            fields = stat_file.read_text().rsplit(")", 1)[1].split()
+            children[int(fields[1])].append(int(stat_file.parent.name))
+
+    rv = []
+    stack = [pid]
+    while stack:
+        for child in children[stack.pop()]:
+            rv.append(child)
+            stack.append(child)
+    return rv
+
+
+def kill_tree(pid: int) -> None:
+    """Kills a process along with every process it has started."""
+    if sys.platform == "win32":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        return
+
+    for p in [pid, *_descendants(pid)]:
+        with suppress(ProcessLookupError, PermissionError):
+            os.kill(p, signal.SIGKILL)
+
+
+class ProcessGroup:
+    """The processes started on behalf of a single task, so that all of them
+    can be killed when the task runs out of time."""
+
+    def __init__(self) -> None:
+        self._pids: list[int] = []
+        self._lock = threading.Lock()
+        self.killed = False
+
+    def add(self, pid: int) -> None:
+        with self._lock:
+            self._pids.append(pid)
+            killed = self.killed
+
+        if killed:
+            kill_tree(pid)
+
+    def kill(self) -> None:
+        with self._lock:
+            self.killed = True
+            pids = list(self._pids)
+
+        for pid in pids:
+            kill_tree(pid)
+
+
+current_process_group: ContextVar[ProcessGroup | None] = ContextVar(
+    "current_process_group", default=None
+)
+
+
+def register_process(pid: int | None) -> None:
+    """Adds `pid` to the process group of the current context, if any."""
+    group = current_process_group.get()
+    if group is not None and pid is not None:
+        group.add(pid)
+
+
+def run_process(args: list[str]) -> "subprocess.CompletedProcess[bytes]":
+    """Like `subprocess.run(args, capture_output=True)`, but the process joins
+    the current process group."""
+    with subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as process:
+        register_process(process.pid)
+        stdout, stderr = process.communicate()
+
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
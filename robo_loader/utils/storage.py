@@ -0,0 +1,184 @@
+import hashlib
+import json
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Protocol
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class RemoteFile:
+    id: str
+    title: str
+    md5: str
+    size: int
+    modified: str  # ISO 8601
+    owner: str
+
+    def to_json(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def from_json(data: dict) -> "RemoteFile":
+        return RemoteFile(**data)
+
+
+class RangeIgnoredError(IOError):
+    """The server sent the file from its start instead of from the offset."""
+
+
+@dataclass(frozen=True)
+class Changes:
+    changed: list[RemoteFile]
+    removed: list[str]
+    token: str
+    # The listing is complete, files that aren't in it were removed
+    complete: bool
+
+
+class StorageBackend(Protocol):
+    def list_changes(self, token: str | None) -> Changes:
+        """Files changed since `token`, every file if `token` is `None`."""
+        ...
+
+    def iter_chunks(self, file: RemoteFile, offset: int) -> Iterator[bytes]:
+        """Contents of `file` starting from `offset`, raises `RangeIgnoredError`
+        if it can't start there."""
+        ...
+
+
+class PyDriveBackend:
+    """A Google Drive folder, listed incrementally through the changes API."""
+
+    def __init__(self, folder_id: str, credentials_file: str = "creds") -> None:
+        from pydrive.auth import GoogleAuth
+        from pydrive.drive import GoogleDrive
+
+        self.folder_id = folder_id
+        self.gauth = GoogleAuth()
+        self.gauth.LoadCredentialsFile(credentials_file)
+        self.drive = GoogleDrive(self.gauth)
+        # httplib2 isn't thread safe, every download thread has its own
+        self._local = threading.local()
+
+    def _to_remote_file(self, file: dict) -> RemoteFile:
+        return RemoteFile(
+            id=file["id"],
+            title=file["title"],
+            md5=file.get("md5Checksum", ""),
+            size=int(file.get("fileSize", 0)),
+            modified=file["modifiedDate"],
+            owner=file["lastModifyingUserName"],
+        )
+
+    def _in_folder(self, file: dict) -> bool:
+        return not file.get("labels", {}).get("trashed", False) and any(
+            parent["id"] == self.folder_id for parent in file.get("parents", [])
+        )
+
+    def list_changes(self, token: str | None) -> Changes:
+        service = self.gauth.service
+        if token is None:
+            new_token = service.changes().getStartPageToken().execute()
+            files = self.drive.ListFile(
+                {"q": f"'{self.folder_id}' in parents and trashed=false"}
+            ).GetList()
+            return Changes(
+                [self._to_remote_file(file) for file in files],
+                [],
+                new_token["startPageToken"],
+                complete=True,
+            )
+
+        changed, removed = [], []
+        page_token = token
+        while True:
+            response = (
+                service.changes()
+                .list(pageToken=page_token, includeDeleted=True)
+                .execute()
+            )
+            for change in response.get("items", []):
+                file = change.get("file")
+                if change.get("deleted") or file is None or not self._in_folder(file):
+                    removed.append(change["fileId"])
+                else:
+                    changed.append(self._to_remote_file(file))
+
+            if "nextPageToken" in response:
+                page_token = response["nextPageToken"]
+            else:
+                return Changes(
+                    changed, removed, response["newStartPageToken"], complete=False
+                )
+
+    def iter_chunks(self, file: RemoteFile, offset: int) -> Iterator[bytes]:
+        if not hasattr(self._local, "http"):
+            self._local.http = self.gauth.Get_Http_Object()
+
+        uri = self.gauth.service.files().get_media(fileId=file.id).uri
+        while offset < file.size:
+            end = min(offset + CHUNK_SIZE, file.size) - 1
+            response, content = self._local.http.request(
+                uri, headers={"Range": f"bytes={offset}-{end}"}
+            )
+            # 200 is the whole file, it would be appended to what we have
+            if response.status == 200 and offset > 0:
+                raise RangeIgnoredError(f"{file.title} was sent from its start")
+            if response.status not in (200, 206):
+                raise IOError(f"Downloading {file.title} failed: {response.status}")
+            yield content
+            offset += len(content)
+
+
+class LocalDirectoryBackend:
+    """Serves the files of a local directory as if it was the Drive folder,
+    for tests and benchmarks.
+
+    Files in `<root>/<owner>/` belong to `owner`, the others to their stem.
+    The change token is a snapshot of the files' mtimes.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def _files(self) -> dict[str, Path]:
+        return {
+            path.relative_to(self.root).as_posix(): path
+            for path in self.root.rglob("*")
+            if path.is_file()
+        }
+
+    def _to_remote_file(self, file_id: str, path: Path) -> RemoteFile:
+        stat = path.stat()
+        relative = path.relative_to(self.root)
+        return RemoteFile(
+            id=file_id,
+            title=path.name,
+            md5=hashlib.md5(path.read_bytes()).hexdigest(),
+            size=stat.st_size,
+            modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(),
+            owner=relative.parts[0] if len(relative.parts) > 1 else path.stem,
+        )
+
+    def list_changes(self, token: str | None) -> Changes:
+        files = self._files()
+        snapshot = {file_id: path.stat().st_mtime_ns for file_id, path in files.items()}
+        previous: dict[str, int] = json.loads(token) if token is not None else {}
+
+        changed = [
+            self._to_remote_file(file_id, path)
+            for file_id, path in files.items()
+            if previous.get(file_id) != snapshot[file_id]
+        ]
+        removed = [file_id for file_id in previous if file_id not in files]
+        return Changes(changed, removed, json.dumps(snapshot), complete=token is None)
+
+    def iter_chunks(self, file: RemoteFile, offset: int) -> Iterator[bytes]:
+        with (self.root / file.id).open("rb") as f:
+            f.seek(offset)
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
@@ -1,21 +1,40 @@
+import argparse
 import concurrent.futures
+import hashlib
+import json
+import shutil
+import subprocess
+import sys
 from pathlib import Path
+from time import perf_counter
+from typing import get_args
 
 import rich
 import rich.live
 import rich.progress
 import rich.status
+import rich.table
 import rich.terminal_theme
 import rich.theme
 import rich.themes
 
 from robo_loader import ROOT_PATH
 from robo_loader.impl import module_loader
-from robo_loader.testing.runner import TestRunner, TestResults, TestStatus
-from robo_loader.utils.fs import rmrf
+from robo_loader.testing.cache import TestCache
+from robo_loader.testing.history import PhaseTimings, TestHistory
+from robo_loader.testing.limiter import AdaptiveLimiter
+from robo_loader.testing.runner import TestResult, TestResults, TestRunner, TestStatus
+from robo_loader.testing.test_model import TestResource
+from robo_loader.testing.unit_tests import tests
+from robo_loader.utils.fs import trash, wait_for_trash
+from robo_loader.utils.manifest import FileManifest
 from rich.markup import escape as e
 
 logs_path = ROOT_PATH / "logs"
+test_cache_path = ROOT_PATH / "test_cache"
+shards_path = ROOT_PATH / "shards"
+history_path = ROOT_PATH / "test_history.sqlite"
+max_log_bytes = 10 * 1024 * 1024
 Results = dict[Path, TestResults]
 
 
@@ -25,32 +44,79 @@ class UngracefulThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
         return False
 
 
-def test_all():
-    if logs_path.exists():
-        rmrf(logs_path)
-    logs_path.mkdir(exist_ok=True)
+def shard_module_paths(module_paths: list[Path], shard: int, count: int) -> list[Path]:
+    """The modules of the `shard`th of `count` shards. A module always lands in
+    the same shard, whatever the other modules are or their order."""
 
-    def test_module(module_path: Path) -> tuple[Path, TestResults]:
-        test_runner = TestRunner(logs_path / module_path.name)
+    def shard_of(module_path: Path) -> int:
+        digest = hashlib.sha1(module_path.name.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % count
+
+    return [p for p in module_paths if shard_of(p) == shard]
+
+
+class ModuleTester:
+    """Tests modules one call at a time, sharing the cache and the limiter
+    between calls. Clears `output_path` first.
+
+    Uses `manifest` if given, otherwise opens one and closes it in `close`."""
+
+    def __init__(
+        self, output_path: Path = logs_path, manifest: FileManifest | None = None
+    ) -> None:
+        trash(output_path)
+        output_path.mkdir(exist_ok=True)
+
+        self.output_path = output_path
+        self._owns_manifest = manifest is None
+        self.manifest = manifest or FileManifest()
+        self.cache = TestCache(test_cache_path, tests.version, self.manifest)
+        self.limiter = AdaptiveLimiter()
+
+    def __call__(self, module_path: Path) -> tuple[Path, TestResults, dict[str, float]]:
+        test_runner = TestRunner(
+            self.output_path / module_path.name,
+            cache=self.cache,
+            max_log_bytes=max_log_bytes,
+            limiter=self.limiter,
+        )
         test_results = test_runner.run(module_path)
 
-        return module_path, test_results
+        return module_path, test_results, test_runner.phase_timings
 
-    module_paths = module_loader.get_module_paths()
-    with UngracefulThreadPoolExecutor(max_workers=10) as executor:
-        results: Results = {}
-        futures = [
-            executor.submit(test_module, module_path) for module_path in module_paths
-        ]
+    def close(self) -> None:
+        if self._owns_manifest:
+            self.manifest.close()
+
+
+def test_all(
+    module_paths: list[Path] | None = None, output_path: Path = logs_path
+) -> tuple[Results, PhaseTimings]:
+    test_module = ModuleTester(output_path)
 
-        with rich.progress.Progress() as progress:
-            task = progress.add_task("Testing modules...", total=len(module_paths))
-            for future in concurrent.futures.as_completed(futures):
-                module_path, test_results = future.result()
-                results[module_path] = test_results
-                progress.advance(task)
+    if module_paths is None:
+        module_paths = module_loader.get_module_paths()
 
-    return results
+    # The limiter decides how many tests actually run at once
+    try:
+        with UngracefulThreadPoolExecutor(max_workers=32) as executor:
+            results: Results = {}
+            phase_timings: PhaseTimings = {}
+            futures = [
+                executor.submit(test_module, module_path)
+                for module_path in module_paths
+            ]
+
+            with rich.progress.Progress() as progress:
+                task = progress.add_task("Testing modules...", total=len(module_paths))
+                for future in concurrent.futures.as_completed(futures):
+                    module_path, test_results, timings = future.result()
+                    results[module_path] = test_results
+                    phase_timings[module_path] = timings
+                    progress.advance(task)
+    finally:
+        test_module.close()
+    return results, phase_timings
 
 
 def report_results(results: Results):
@@ -67,6 +133,8 @@ def report_results(results: Results):
         console.print(f"[red]✗ {e(module_path.stem)}")
         for test, result in test_results.items():
             test_repr = f"{test.name} ({test.description})"
+            if result.cached:
+                test_repr += " [önbellek]"
             match result.status:
                 case TestStatus.PASSED:
                     console.print(f"[green]  ✓ {e(test_repr)}")
@@ -74,18 +142,89 @@ def report_results(results: Results):
                     console.print(f"[yellow]  ! {e(test_repr)}: {e(result.message)}")
                 case TestStatus.FAILED:
                     console.print(f"[red]  ✗ {e(test_repr)}: {e(result.message)}")
+                case TestStatus.TIMED_OUT:
+                    console.print(f"[magenta]  ⏱ {e(test_repr)}: {e(result.message)}")
 
     console.save_html(
         str(logs_path / "test_results.html"), theme=rich.terminal_theme.MONOKAI
     )
 
 
-def package_to_share():
-    import shutil
+def report_timings(results: Results):
+    """Prints where the suite's time went, slowest modules first. Cached
+    results took no time in this run, they are only counted."""
+    table = rich.table.Table(title="Süreler (sn)")
+    table.add_column("Modül")
+    table.add_column("Toplam", justify="right")
+    for resource in get_args(TestResource):
+        table.add_column(resource, justify="right")
+    table.add_column("En yavaş test")
+    table.add_column("Önbellek", justify="right")
+
+    def ran(test_results: TestResults) -> TestResults:
+        return {t: r for t, r in test_results.items() if not r.cached}
 
+    def total(test_results: TestResults) -> float:
+        return sum(result.duration for result in ran(test_results).values())
+
+    for module_path, test_results in sorted(
+        results.items(), key=lambda item: total(item[1]), reverse=True
+    ):
+        by_resource = {resource: 0.0 for resource in get_args(TestResource)}
+        for test, result in ran(test_results).items():
+            by_resource[test.resource] += result.duration
+
+        slowest = "-"
+        if ran(test_results):
+            test, result = max(
+                ran(test_results).items(), key=lambda item: item[1].duration
+            )
+            slowest = f"{e(test.name)} ({result.duration:.1f})"
+        table.add_row(
+            e(module_path.stem),
+            f"{total(test_results):.1f}",
+            *(f"{duration:.1f}" for duration in by_resource.values()),
+            slowest,
+            str(len(test_results) - len(ran(test_results))),
+        )
+
+    rich.print(table)
+
+
+def report_history(
+    results: Results, phase_timings: PhaseTimings, wall_time: float | None
+):
+    """Stores the timings of this run and prints the ones that got
+    significantly slower than in the previous runs."""
+    history = TestHistory(history_path)
+    try:
+        run_id = history.record(results, phase_timings, wall_time)
+        regressions = history.regressions(run_id)
+    finally:
+        history.close()
+
+    if not regressions:
+        rich.print("[green]Süre gerilemesi yok.")
+        return
+
+    table = rich.table.Table(title="Süre gerilemeleri (sn)")
+    table.add_column("Modül")
+    table.add_column("Ölçüm")
+    table.add_column("Bu çalışma", justify="right")
+    table.add_column("Geçmiş (medyan)", justify="right")
+    for regression in regressions:
+        table.add_row(
+            e(regression.module or "(tüm testler)"),
+            e(regression.metric),
+            f"{regression.duration:.1f}",
+            f"{regression.baseline:.1f}",
+        )
+    rich.print(table)
+
+
+def package_to_share():
     share_dir = ROOT_PATH / "share"
-    if share_dir.exists():
-        rmrf(share_dir)
+    trash(share_dir)
     share_dir.mkdir()
 
     html_file = logs_path / "test_results.html"
@@ -94,10 +233,182 @@ def package_to_share():
     shutil.make_archive(str(share_dir / "logs"), "zip", logs_path)
 
 
+def save_results(results: Results, phase_timings: PhaseTimings, path: Path):
+    data = {
+        "version": tests.version,
+        "modules": {
+            str(module_path): {
+                test.name: result.to_json() for test, result in test_results.items()
+            }
+            for module_path, test_results in results.items()
+        },
+        "phase_timings": {
+            str(module_path): timings
+            for module_path, timings in phase_timings.items()
+        },
+    }
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def load_results(path: Path) -> tuple[Results, PhaseTimings]:
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data["version"] != tests.version:
+        raise ValueError(f"{path} was produced by another version of the tests")
+
+    metas = {test.test_meta.name: test.test_meta for test in tests.tests}
+    results = {
+        Path(module_path): {
+            metas[name]: TestResult.from_json(result)
+            for name, result in test_results.items()
+        }
+        for module_path, test_results in data["modules"].items()
+    }
+    phase_timings = {
+        Path(module_path): timings
+        for module_path, timings in data["phase_timings"].items()
+    }
+    return results, phase_timings
+
+
+def shard_dir(output_path: Path) -> Path:
+    """Where a shard given `--output output_path` writes. It is cleared first,
+    so it is a directory of our own rather than whatever the user named."""
+    return output_path / "robo_loader_shard"
+
+
+def run_shard(shard: int, count: int, output_path: Path):
+    """Tests one shard, the results and logs are written under `output_path`
+    to be merged with `merge_shards` later, possibly on another machine."""
+    module_paths = shard_module_paths(module_loader.get_module_paths(), shard, count)
+    output_path.mkdir(parents=True, exist_ok=True)
+    results, phase_timings = test_all(module_paths, shard_dir(output_path))
+    save_results(results, phase_timings, shard_dir(output_path) / "results.json")
+
+
+def merge_shards(shard_paths: list[Path]) -> tuple[Results, PhaseTimings]:
+    """Collects the results and logs of `run_shard` outputs into `logs_path`."""
+    trash(logs_path)
+    logs_path.mkdir()
+
+    results: Results = {}
+    phase_timings: PhaseTimings = {}
+    for output_path in shard_paths:
+        shard_path = shard_dir(output_path)
+        shard_results, shard_timings = load_results(shard_path / "results.json")
+        for module_path in shard_results:
+            module_logs = shard_path / module_path.name
+            if module_logs.exists():
+                shutil.copytree(
+                    module_logs, logs_path / module_path.name, dirs_exist_ok=True
+                )
+        results.update(shard_results)
+        phase_timings.update(shard_timings)
+
+    return results, phase_timings
+
+
+def run_local_workers(count: int) -> tuple[Results, PhaseTimings]:
+    """Runs every shard in a worker process of its own, as if each was a
+    separate machine, and merges their outputs."""
+    trash(shards_path)
+    shards_path.mkdir()
+
+    workers = []
+    for shard in range(count):
+        output_path = shards_path / str(shard)
+        with (shards_path / f"{shard}.out").open("wb") as out:
+            workers.append(
+                subprocess.Popen(
+                    [
+                        sys.executable,
+                        "-m",
+                        "robo_loader.utils.test_all",
+                        "--shard",
+                        f"{shard}/{count}",
+                        "--output",
+                        str(output_path),
+                    ],
+                    stdout=out,
+                    stderr=subprocess.STDOUT,
+                )
+            )
+
+    with rich.status.Status(f"Waiting for {count} workers..."):
+        for shard, worker in enumerate(workers):
+            if worker.wait() != 0:
+                rich.print(
+                    f"[red]Worker {shard} failed, see {shards_path / f'{shard}.out'}"
+                )
+
+    return merge_shards(
+        [
+            shards_path / str(shard)
+            for shard in range(count)
+            if (shard_dir(shards_path / str(shard)) / "results.json").exists()
+        ]
+    )
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    shard, count = (int(part) for part in value.split("/"))
+    if not 0 <= shard < count:
+        raise argparse.ArgumentTypeError(f"Invalid shard: {value}")
+    return shard, count
+
+
 def main():
-    results = test_all()
+    parser = argparse.ArgumentParser(description="Tests every module.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--shard",
+        type=parse_shard,
+        metavar="I/N",
+        help="Only test the I'th of N shards and write the results to --output",
+    )
+    group.add_argument(
+        "--merge",
+        type=Path,
+        nargs="+",
+        metavar="DIR",
+        help="Merge the outputs of --shard runs and report them",
+    )
+    group.add_argument(
+        "--local-workers",
+        type=int,
+        metavar="N",
+        help="Split the modules into N shards tested by local worker processes",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        help="Output directory of --shard, only its robo_loader_shard "
+        "subdirectory is replaced",
+    )
+    args = parser.parse_args()
+
+    if args.shard is not None:
+        if args.output is None:
+            parser.error("--shard requires --output")
+        run_shard(*args.shard, args.output)
+        wait_for_trash()
+        return
+
+    start = perf_counter()
+    if args.merge is not None:
+        results, phase_timings = merge_shards(args.merge)
+        wall_time = None
+    elif args.local_workers is not None:
+        results, phase_timings = run_local_workers(args.local_workers)
+        wall_time = perf_counter() - start
+    else:
+        results, phase_timings = test_all()
+        wall_time = perf_counter() - start
+
     report_results(results)
+    report_timings(results)
+    report_history(results, phase_timings, wall_time)
     package_to_share()
+    wait_for_trash()
 
 
 if __name__ == "__main__":
@@ -1,55 +1,80 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
 import concurrent.futures
-from pathlib import Path
+from pathlib import Path, PurePosixPath
+import shutil
 import subprocess
 import os
 import sys
 import tempfile
+from typing import Callable
+import zipfile
 import concurrent
 from loguru import logger
 from rich.progress import Progress
 from robo_loader import ROOT_PATH
 
-from robo_loader.utils.fs import rmrf
+from robo_loader.utils.bytecode import compile_tree
+from robo_loader.utils.fs import move_to_trash, trash, wait_for_trash
+from robo_loader.utils.manifest import FileManifest
+
+# Optional, not a declared dependency. Without it .7z archives are extracted
+# by the 7z binary, like every format other than zip.
+try:
+    import py7zr
+except ImportError:
+    py7zr = None
+
+# Unsupported methods, encryption and corruption the 7z binary may handle
+_UNREADABLE_ERRORS: tuple[type[Exception], ...] = (
+    zipfile.BadZipFile,
+    NotImplementedError,
+    RuntimeError,
+)
+if py7zr is not None:
+    _UNREADABLE_ERRORS += (
+        py7zr.exceptions.ArchiveError,
+        py7zr.exceptions.PasswordRequired,
+        py7zr.exceptions.AbsolutePathError,
+    )
+
+staging_path = ROOT_PATH / ".unzip_staging"
+
+# Never extracted, whichever directory they are in
+EXCLUDED_NAMES = {"site-packages", "venv", ".venv"}
 
 
 class FileStructureError(Exception):
-    def __init__(self) -> None:
-        super().__init__("Unknown archive structure")
+    # The message argument lets the error be pickled back from worker processes
+    def __init__(self, message: str = "Unknown archive structure") -> None:
+        super().__init__(message)
+
+
+def seven_zip_path() -> str:
+    if sys.platform == "win32":
+        return str(ROOT_PATH / "bin" / "7-Zip" / "7z.exe")
+    return shutil.which("7z") or shutil.which("7zz") or "7z"
 
 
 def unzip_with_7z(archive_path: Path, target: Path) -> None:
     if not os.path.exists(archive_path):
         raise FileNotFoundError(f"The archive {archive_path} does not exist.")
 
-    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as temp_dir:
+    staging_path.mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory(
+        dir=staging_path, ignore_cleanup_errors=True
+    ) as temp_dir:
         command = [
-            str(ROOT_PATH / "bin" / "7-Zip" / "7z.exe"),
+            seven_zip_path(),
             "x",
             str(archive_path),
             f"-o{temp_dir}",
-            "-xr!site-packages",
-            "-xr!venv",
-            "-xr!.venv",
+            *(f"-xr!{name}" for name in EXCLUDED_NAMES),
         ]
 
         subprocess.check_call(command, stdout=subprocess.DEVNULL, stderr=sys.stderr)
 
-        temp = Path(temp_dir)
-
-        with logger.catch(FileStructureError, reraise=False):
-            project_dir = infer_project_dir(temp)
-
-            if target.exists():
-                if target.is_dir():
-                    rmrf(target)
-                else:
-                    target.unlink()
-
-            if not target.parent.exists():
-                target.parent.mkdir(parents=True)
-
-            project_dir.rename(target)
+        project_dir = infer_project_dir(Path(temp_dir))
+        _move_into_place(project_dir, target)
 
 
 def infer_project_dir(input_dir: Path) -> Path:
@@ -64,10 +89,247 @@ def infer_project_dir(input_dir: Path) -> Path:
     elif len(contents) == 1 and contents[0].is_dir():
         return infer_project_dir(contents[0])
     else:
-        subprocess.call(["tree.com", str(input_dir)])
+        logger.error(f"Contents of {input_dir}: {[p.name for p in contents]}")
         raise FileStructureError()
 
 
+def infer_project_prefix(names: list[str]) -> str:
+    """`infer_project_dir` on an archive listing. Returns the prefix of the
+    project directory's members, `""` or ending with `/`."""
+    files = set()
+    dirs = set()
+    for name in names:
+        parts = PurePosixPath(name).parts
+        if name.endswith("/"):
+            dirs.add("/".join(parts) + "/")
+        else:
+            files.add("/".join(parts))
+        # Some archives don't list the directories themselves
+        for i in range(1, len(parts)):
+            dirs.add("/".join(parts[:i]) + "/")
+
+    prefix = ""
+    while True:
+        children = {
+            path[len(prefix) :].split("/", 1)[0]
+            for path in files | dirs
+            if path.startswith(prefix) and path != prefix
+        }
+        children.discard("__MACOSX")
+
+        if f"{prefix}requirements.txt" in files:
+            return prefix
+        elif f"{prefix}robo_core/" in dirs:
+            prefix += "robo_core/"
+        elif f"{prefix}robo-core/" in dirs:
+            prefix += "robo-core/"
+        elif len(children) == 1 and f"{prefix}{next(iter(children))}/" in dirs:
+            prefix += f"{next(iter(children))}/"
+        else:
+            logger.error(f"Contents of {prefix or '/'}: {sorted(children)}")
+            raise FileStructureError()
+
+
+def _selected_members(names: list[str], prefix: str, temp_dir: Path) -> list[str]:
+    """Members under `prefix`, without the excluded directories and the ones
+    that would end up outside `temp_dir`."""
+    root = temp_dir.resolve()
+    rv = []
+    for name in names:
+        if not name.startswith(prefix) or name == prefix:
+            continue
+        if EXCLUDED_NAMES.intersection(PurePosixPath(name).parts):
+            continue
+        # Also catches ..\ parts, drive and UNC names, which escape on Windows
+        if not (temp_dir / name).resolve().is_relative_to(root):
+            logger.warning(f"Skipping {name!r}, it is outside the archive")
+            continue
+        rv.append(name)
+    return rv
+
+
+def _extract_zip(archive_path: Path, temp_dir: Path) -> Path:
+    with zipfile.ZipFile(archive_path) as archive:
+        names = archive.namelist()
+        prefix = infer_project_prefix(names)
+        for name in _selected_members(names, prefix, temp_dir):
+            destination = temp_dir / name
+            if name.endswith("/"):
+                destination.mkdir(parents=True, exist_ok=True)
+                continue
+
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            with archive.open(name) as src, destination.open("wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    return temp_dir / prefix
+
+
+def _extract_7z(archive_path: Path, temp_dir: Path) -> Path:
+    assert py7zr is not None
+    with py7zr.SevenZipFile(archive_path) as archive:
+        entries = archive.list()
+        names = [
+            entry.filename + "/" if entry.is_directory else entry.filename
+            for entry in entries
+        ]
+        prefix = infer_project_prefix(names)
+        targets = [
+            name.rstrip("/") for name in _selected_members(names, prefix, temp_dir)
+        ]
+        archive.extract(temp_dir, targets=targets)
+
+    return temp_dir / prefix
+
+
+def _move_into_place(project_dir: Path, target: Path) -> None:
+    # Raises instead of deleting a module that is in use
+    move_to_trash(target)
+
+    if not target.parent.exists():
+        target.parent.mkdir(parents=True)
+
+    project_dir.mkdir(parents=True, exist_ok=True)
+    project_dir.rename(target)
+
+
+def extract_archive(archive_path: Path, target: Path) -> None:
+    """Extracts the project inside `archive_path` to `target`, without the
+    excluded directories. Zip and (with py7zr) 7z archives are read
+    in-process, anything else is left to the 7z binary, as are the archives
+    they can't read."""
+    suffix = archive_path.suffix.lower()
+    extract = None
+    if suffix == ".zip":
+        extract = _extract_zip
+    elif suffix == ".7z" and py7zr is not None:
+        extract = _extract_7z
+
+    if extract is not None:
+        staging_path.mkdir(exist_ok=True)
+        with tempfile.TemporaryDirectory(
+            dir=staging_path, ignore_cleanup_errors=True
+        ) as temp_dir:
+            try:
+                project_dir = extract(archive_path, Path(temp_dir))
+            except _UNREADABLE_ERRORS as e:
+                logger.warning(f"Could not read {archive_path.name} ({e}), using 7z")
+            else:
+                _move_into_place(project_dir, target)
+                # Archives are already extracted in parallel
+                compile_tree(target, workers=1)
+                return
+
+    unzip_with_7z(archive_path, target)
+    compile_tree(target, workers=1)
+
+
+def extract_all(
+    archives: list[Path],
+    target_dir: Path,
+    max_workers: int | None = None,
+    progress: Progress | None = None,
+    on_extracted: Callable[[Path], None] | None = None,
+) -> list[Path]:
+    """Extracts every archive into `target_dir/<archive stem>` in parallel
+    and returns the archives that were extracted. `on_extracted` is called
+    with each archive as soon as it is done."""
+    extracted = []
+    with ProcessPoolExecutor(max_workers) as executor:
+        task = (
+            progress.add_task("Extracting files", total=len(archives))
+            if progress is not None
+            else None
+        )
+        futures = {
+            executor.submit(
+                extract_archive, archive, target_dir / archive.stem
+            ): archive
+            for archive in archives
+        }
+        for future in concurrent.futures.as_completed(futures):
+            archive = futures[future]
+            try:
+                future.result()
+                extracted.append(archive)
+                if on_extracted is not None:
+                    on_extracted(archive)
+            except (FileStructureError, zipfile.BadZipFile, OSError) as e:
+                logger.error(f"Could not extract {archive.name}: {e}")
+            except subprocess.CalledProcessError as e:
+                logger.error(f"7z could not extract {archive.name}: {e}")
+            if progress is not None:
+                progress.advance(task)
+
+    return extracted
+
+
+def swap_in(staged: Path, target: Path) -> None:
+    """Replaces `target` with `staged` using renames only, so `target` is
+    never half extracted, at worst missing between the two renames. Raises
+    `OSError` with `target` left in place if it can't be moved away."""
+    move_to_trash(target)
+    staged.rename(target)
+
+
+def changed_archives(
+    archives: list[Path], target_dir: Path, manifest: FileManifest
+) -> list[Path]:
+    """Archives whose module is missing or was extracted from other content."""
+    rv = []
+    for archive in archives:
+        origin = manifest.origin(archive.stem)
+        if (
+            origin is None
+            or not (target_dir / archive.stem).is_dir()
+            or origin.archive_hash != manifest.fast_hash(archive)
+        ):
+            rv.append(archive)
+    return rv
+
+
+def prepare_staging() -> Path:
+    """Cleans up after an interrupted run and returns the directory modules
+    are extracted into before being swapped in."""
+    staged_modules_path = staging_path / "modules"
+    trash(staged_modules_path)
+    staged_modules_path.mkdir(parents=True)
+    return staged_modules_path
+
+
+def install(
+    archive: Path, staged_modules_path: Path, target_dir: Path, manifest: FileManifest
+) -> bool:
+    """Swaps the extracted module of `archive` into `target_dir`."""
+    target = target_dir / archive.stem
+    try:
+        swap_in(staged_modules_path / archive.stem, target)
+    except OSError:
+        # Most likely a file in the old module is still open
+        logger.exception(f"Could not replace {target.name}, keeping the old one")
+        return False
+    manifest.forget(target)
+    manifest.set_origin(target.name, archive)
+    return True
+
+
+def retire_removed(
+    archive_stems: set[str], target_dir: Path, manifest: FileManifest
+) -> None:
+    """Retires the modules that have no archive anymore."""
+    for dir in target_dir.iterdir():
+        if dir.name not in archive_stems:
+            logger.info(f"Retiring {dir.name}")
+            try:
+                move_to_trash(dir)
+            except OSError:
+                # Most likely a file in it is still open, try again next run
+                logger.exception(f"Could not retire {dir.name}, leaving it in place")
+                continue
+            manifest.forget(dir)
+            manifest.remove_origin(dir.name)
+
+
 def main():
     target_dir = ROOT_PATH / "modules"
     if not target_dir.exists():
@@ -76,18 +338,27 @@ def main():
     gdrive_path = ROOT_PATH / "gdrive"
     gdrive_files = list(gdrive_path.iterdir())
 
-    target_files = list(target_dir.iterdir())
+    manifest = FileManifest()
+    staged_modules_path = prepare_staging()
 
-    with ThreadPoolExecutor(max_workers=10) as executor, Progress() as progress:
-        task = progress.add_task("Deleting old files", total=len(target_files))
-        futures = [executor.submit(rmrf, dir) for dir in target_files]
+    to_extract = changed_archives(gdrive_files, target_dir, manifest)
+    logger.info(
+        f"{len(to_extract)} of {len(gdrive_files)} archives changed, extracting"
+    )
 
-        for future in concurrent.futures.as_completed(futures):
-            future.result()
-            progress.advance(task)
+    with Progress() as progress:
+        extract_all(
+            to_extract,
+            staged_modules_path,
+            progress=progress,
+            on_extracted=lambda archive: install(
+                archive, staged_modules_path, target_dir, manifest
+            ),
+        )
 
-    for file in progress.track(gdrive_files, description="Extracting files"):
-        unzip_with_7z(file, target_dir / file.stem)
+    retire_removed({file.stem for file in gdrive_files}, target_dir, manifest)
+    manifest.close()
+    wait_for_trash()
 
 
 if __name__ == "__main__":